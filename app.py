@@ -1,20 +1,30 @@
 import os
-import json
-from typing import cast
+import asyncio
+from functools import cache
+from typing import cast, Optional, TYPE_CHECKING
 
 import chainlit as cl
 from dotenv import load_dotenv
-from langgraph.graph.state import CompiledStateGraph
-from langchain_core.messages import AIMessage, HumanMessage
+from chainlit.server import app as server_app
 from chainlit.user_session import UserSession
+from fastapi import Header
+from fastapi.responses import JSONResponse, PlainTextResponse
 
-from src.reranker import Reranker
-from src.llm import BedrockLLM
-from src.workflow.node.quick_responder import QuickResponder
-from src.workflow.node.task_summarizer import TaskSummarizer
-from src.workflow.graph import ResearchFlow
+from src.admission import admission
 from src.logger import get_logger
 
+if TYPE_CHECKING:
+    # heavy modules (langgraph, langchain_aws, boto3, tavily, ...) are imported lazily
+    # on the first chat session to keep the cold start of the app cheap
+    from langgraph.graph.state import CompiledStateGraph
+    from src.llm_tiering import NodeModels
+    from src.workflow.node.quick_responder import QuickResponder
+    from src.workflow.node.task_summarizer import TaskSummarizer
+    from src.prefetcher import Prefetcher
+    from src.workflow.deadline import Deadline
+    from src.workflow.state import ResearchState
+    from src.workload.recording import ConversationRecord, WorkloadRecorder
+
 load_dotenv()
 
 
@@ -36,70 +46,311 @@ PHOENIX_PROJECT_NAME = os.environ.get("PHOENIX_PROJECT_NAME", "default")
 PHOENIX_ENDPOINT = os.environ.get("PHOENIX_ENDPOINT", "")
 
 
-def _deduplicate_source(sources: list[dict]) -> list[str]:
-    """
-    We are going to use rerank with JSON string input, because url data should be stick to the content in order.
+# for workload recording, see `src.workload.replayer` for replaying the recordings
+WORKLOAD_RECORD_PATH = os.environ.get("WORKLOAD_RECORD_PATH", "")
 
-    1. deduplicate sources based on the URL
-    2. leave title, url and content field only
-    3. stringify each content
-    """
-    D = {source["url"]: source for source in sources}
-    return [
-        json.dumps(
-            {"title": source["title"], "url": source["url"], "content": source["content"]})
-        for source in D.values()
-    ]
 
+# for predictive prefetch of follow-up searches, see `src.prefetcher`
+PREFETCH_ENABLED = os.environ.get("PREFETCH_ENABLED", "false").lower() == "true"
+# prefetching waits while this many requests or more are running or queued
+PREFETCH_MAX_ACTIVE_REQUESTS = int(
+    os.environ.get("PREFETCH_MAX_ACTIVE_REQUESTS", 1))
 
-async def rerank(user_input: str, sources: list[dict]) -> list[dict]:
-    reranker = Reranker(
+
+@cache
+def get_prefetcher() -> "Prefetcher":
+    from src.prefetcher import Prefetcher
+
+    return Prefetcher(
+        is_busy=lambda: admission.in_flight + admission.queued >= PREFETCH_MAX_ACTIVE_REQUESTS,
+    )
+
+
+@cache
+def get_node_models() -> "NodeModels":
+    """Share the models, their clients and circuit breakers across sessions, see `src.llm_tiering` for the configuration by node."""
+    from src.llm_tiering import create_node_models
+
+    return create_node_models(
+        MODEL_ID,
         aws_profile_name=AWS_PROFILE_NAME,
         aws_region=AWS_REGION,
+        phoenix_project_name=PHOENIX_PROJECT_NAME,
+        phoenix_endpoint=PHOENIX_ENDPOINT,
     )
-    new_sources = await reranker.rerank(
-        query=user_input,
-        docs=_deduplicate_source(sources),
+
+
+@cache
+def get_recorder() -> "WorkloadRecorder":
+    from src.workload.recording import WorkloadRecorder
+
+    logger.info(f"Recording workload at {WORKLOAD_RECORD_PATH}")
+    return WorkloadRecorder(WORKLOAD_RECORD_PATH)
+
+
+async def rerank(user_input: str, sources: list[dict]) -> list[dict]:
+    from src.reranker import rerank as _rerank
+
+    return await _rerank(
+        user_input,
+        sources,
+        aws_profile_name=AWS_PROFILE_NAME,
+        aws_region=AWS_REGION,
         k=5,
     )
-    return [json.loads(ns) for ns in new_sources]
+
+
+def add_route(path: str, endpoint, methods: tuple[str, ...] = ("GET",)) -> None:
+    """Serve a route of the app, ahead of the catch-all route of the Chainlit frontend."""
+    server_app.add_api_route(path, endpoint, methods=list(methods))
+    server_app.router.routes.insert(0, server_app.router.routes.pop())
+
+
+async def metrics(format: str = "prometheus"):
+    """Stats of the app, e.g. the in-flight and queued gauges of the admission control to autoscale on."""
+    from src.metrics import collect, to_prometheus
+
+    snapshots = collect(prefetcher=get_prefetcher().snapshot()) if PREFETCH_ENABLED else collect()
+    if format == "json":
+        return JSONResponse(snapshots)
+    return PlainTextResponse(to_prometheus(snapshots))
+
+
+add_route("/metrics", metrics)
+
+
+# token of the debug routes, sent in the `X-Debug-Token` header, the routes are not served if not set
+PROFILE_DEBUG_TOKEN = os.environ.get("PROFILE_DEBUG_TOKEN", "")
+
+
+def _invalid_debug_token(token: str) -> Optional[JSONResponse]:
+    import secrets
+
+    if not secrets.compare_digest(token.encode(), PROFILE_DEBUG_TOKEN.encode()):
+        return JSONResponse({"error": "invalid token"}, status_code=403)
+    return None
+
+
+async def debug_profile_status(token: str = Header("", alias="X-Debug-Token")):
+    """Status of the request profiler, with the recently written profiles."""
+    from src.profiler import profiler
+
+    if error := _invalid_debug_token(token):
+        return error
+    return JSONResponse(profiler.status())
+
+
+async def debug_profile(
+    token: str = Header("", alias="X-Debug-Token"),
+    session: Optional[str] = None,
+    requests: int = 1,
+    rate: Optional[float] = None,
+):
+    """
+    Control the request profiler at runtime, e.g. `POST /debug/profile?session=<session id>&requests=3`
+    profiles the next 3 requests of the session, `requests=0` stops it, and `rate=0.01` profiles 1% of every request.
+    """
+    from src.profiler import profiler
+
+    if error := _invalid_debug_token(token):
+        return error
+    if session:
+        if requests > 0:
+            profiler.enable_session(session, requests)
+        else:
+            profiler.disable_session(session)
+    if rate is not None:
+        profiler.sample_rate = max(0.0, min(1.0, rate))
+    return JSONResponse(profiler.status())
+
+
+if PROFILE_DEBUG_TOKEN:
+    add_route("/debug/profile", debug_profile_status)
+    add_route("/debug/profile", debug_profile, methods=("POST",))
 
 
 @cl.on_chat_start
 async def on_chat_start():
     """Callback for when the chat starts."""
+    from src.workflow.graph import ResearchFlow
+    from src.workflow.node.quick_responder import QuickResponder
+    from src.workflow.node.task_summarizer import TaskSummarizer
+
+    logger.info("Chat started with session %s", cl.user_session.get("id"))
 
     # setup the agent graph
-    model = BedrockLLM(
-        model=MODEL_ID,
-        aws_profile_name=AWS_PROFILE_NAME,
-        aws_region=AWS_REGION,
-        phoenix_project_name=PHOENIX_PROJECT_NAME,
-        phoenix_endpoint=PHOENIX_ENDPOINT,
-    )
-    task_summarizer = TaskSummarizer(model.model)
+    models = get_node_models()
+    task_summarizer = TaskSummarizer(models["task_summarizer"])
     cl.user_session.set("task-summarizer", task_summarizer)
-    quick_responder = QuickResponder(model.model)
+    quick_responder = QuickResponder(models["quick_responder"])
     cl.user_session.set("quick_responder", quick_responder)
 
-    state_graph = ResearchFlow(model.model).state_graph.compile()
+    state_graph = ResearchFlow(models).state_graph.compile()
     cl.user_session.set("state-graph", state_graph)
 
     # setup the history cache
     cl.user_session.set("history-cache", [])
 
 
-def restore_session(user_session: UserSession) -> tuple[CompiledStateGraph, list]:
+def restore_session(user_session: UserSession) -> tuple["CompiledStateGraph", list]:
     """Restore the session from the user session."""
 
-    state_graph = cast(CompiledStateGraph, user_session.get("state-graph"))
+    state_graph = cast("CompiledStateGraph", user_session.get("state-graph"))
     history_cache = cast(list, user_session.get("history-cache"))
     return (state_graph, history_cache)
 
 
+def cancel_in_flight(reason: str) -> None:
+    """Cancel the request in progress of the session, if any."""
+    in_flight = cl.user_session.get("in-flight")
+    if not in_flight:
+        return
+    scope, task = in_flight
+    if scope.cancel(reason) and task is not asyncio.current_task() and not task.done():
+        task.cancel()
+
+
+@cl.on_stop
+async def on_stop():
+    """Callback for when the user stops the response."""
+    cancel_in_flight("stop")
+
+
+@cl.on_chat_end
+async def on_chat_end():
+    """Callback for when the user disconnects or starts a new chat."""
+    cancel_in_flight("disconnect")
+    if PREFETCH_ENABLED:
+        get_prefetcher().close_session(cl.user_session.get("id"))
+
+
 @cl.on_message
 async def on_message(message: cl.Message):
     """Callback for when a message is received."""
+    from src.cancellation import CancelScope, cancel_stats, current_scope
+    from src.profiler import current_profile, profiler
+    from src.workflow.deadline import new_deadline
+
+    # a new message supersedes the one still in progress
+    cancel_in_flight("new_message")
+    scope = CancelScope()
+    # latency budget of the request including the wait for admission, None if REQUEST_DEADLINE_SECONDS is not set
+    deadline = new_deadline()
+    cl.user_session.set("in-flight", (scope, asyncio.current_task()))
+    token = current_scope.set(scope)
+    try:
+        scope.stage = "admission"
+        if not await admit():
+            # the research pipelines are saturated, answer without researching
+            if deadline:
+                deadline.degrade("overflow")
+            await process_overflow(message)
+            return
+        profile, profile_token = None, None
+        try:
+            profile = profiler.start(cl.user_session.get("id"))
+            profile_token = current_profile.set(profile)
+            if WORKLOAD_RECORD_PATH:
+                await record_message(message, deadline)
+            else:
+                await process_message(message, deadline=deadline)
+        finally:
+            admission.release()
+            if profile_token:
+                current_profile.reset(profile_token)
+            if profile:
+                await asyncio.to_thread(profiler.finish, profile)
+    except asyncio.CancelledError:
+        # stop the sync nodes and searches running on worker threads as well
+        scope.cancel("stop")
+        cancel_stats.cancelled(scope)
+        logger.info("Request cancelled by %s during %s", scope.reason, scope.stage)
+        raise
+    finally:
+        # failed, cancelled and overflowed requests are accounted as well
+        if deadline:
+            deadline.finish()
+        current_scope.reset(token)
+        in_flight = cl.user_session.get("in-flight")
+        if in_flight and in_flight[0] is scope:
+            cl.user_session.set("in-flight", None)
+
+
+async def admit() -> bool:
+    """Wait for a research pipeline while showing the queue position, returns False if not admitted."""
+    notice: Optional[cl.Message] = None
+
+    async def show_position(position: int) -> None:
+        nonlocal notice
+        content = f"Many questions are being researched right now, yours is #{position} in the queue."
+        if notice is None:
+            notice = cl.Message(content=content)
+            await notice.send()
+        else:
+            notice.content = content
+            await notice.update()
+
+    try:
+        return await admission.acquire(show_position)
+    finally:
+        if notice:
+            await notice.remove()
+
+
+async def process_overflow(message: cl.Message):
+    """Answer the message with the quick responder only, when it is not admitted to the research flow."""
+    from langchain_core.messages import AIMessage, HumanMessage
+    from src.cancellation import current_scope
+
+    logger.warning("Not admitted, answering without research")
+    scope = current_scope.get()
+    if scope:
+        scope.stage = "quick_responder"
+    history_cache = cast(list, cl.user_session.get("history-cache"))
+    history_cache.append(HumanMessage(content=message.content))
+
+    ai_msg = cl.Message(content="")
+    quick_responder = cast(
+        "QuickResponder", cl.user_session.get("quick_responder"))
+    await quick_responder(ai_msg, cast("ResearchState", {
+        "user_input": message.content,
+        "messages": history_cache,
+    }))
+    await ai_msg.send()
+    history_cache.append(AIMessage(content=ai_msg.content))
+    cl.user_session.set("history-cache", history_cache)
+
+
+async def record_message(message: cl.Message, deadline: Optional["Deadline"] = None):
+    """Process the message while recording the workload."""
+    from src.workload.recording import current_recording
+
+    recorder = get_recorder()
+    record = recorder.start(
+        session_id=cl.user_session.get("id"),
+        user_input=message.content,
+        history=cast(list, cl.user_session.get("history-cache")),
+    )
+    token = current_recording.set(record)
+    try:
+        await process_message(message, record, deadline)
+    finally:
+        current_recording.reset(token)
+        recorder.finish(record)
+
+
+async def process_message(
+    message: cl.Message,
+    record: Optional["ConversationRecord"] = None,
+    deadline: Optional["Deadline"] = None,
+):
+    """Run the research flow for the message and send the response, `deadline` is finished by the caller."""
+    from langchain_core.messages import AIMessage, HumanMessage
+    from src.cancellation import CancelScope, current_scope
+    from src.page_fetcher import fetch_pages
+    from src.reranker import rank_by_score
+
+    scope = current_scope.get() or CancelScope()
 
     # restore session
     (
@@ -111,18 +362,26 @@ async def on_message(message: cl.Message):
     # set empty ai response message
     ai_msg = cl.Message(content="")
 
+    # full state of the graph, nodes emit only their updates
     state = None
     async with cl.Step(name="Reasoning"):
         # process the message
-        async for event in state_graph.astream(
+        scope.stage = "graph"
+        async for mode, event in state_graph.astream(
             {
                 "user_input": message.content,
                 "messages": history_cache,
+                "deadline": deadline,
             },
-            stream_mode="updates",
+            stream_mode=["updates", "values"],
         ):
+            if mode == "values":
+                state = event
+                continue
+            if record:
+                record.add_event(next(iter(event)))
             if "structured_planner" in event:
-                logger.info(f"Plan: {event['structured_planner']}")
+                logger.info("Plan: %s", event["structured_planner"])
                 planner_event = event["structured_planner"]
                 async with cl.Step(name="Planner") as step:
                     plan = planner_event["plan"]
@@ -131,40 +390,53 @@ async def on_message(message: cl.Message):
                         plan_message = "\n".join(
                             [f"- {task.title}({task.description})" for task in plan.tasks])
                         step.output += f"\n**Tasks:**\n{plan_message}"
-                state = event["structured_planner"]
             elif "task_solver" in event:
-                logger.info(f"Task Solver: {event['task_solver']}")
-                async with cl.Step(name="Task Solver") as step:
-                    tool_call = event["task_solver"]["tool_execution"]
-                    step.input = tool_call["args"]
-                    step.output = tool_call["result"]
-                state = event["task_solver"]
-
-        if state and state["plan"].tasks:
+                logger.info("Task Solver: %s", event["task_solver"])
+                tool_call = event["task_solver"]["tool_execution"]
+                if tool_call:
+                    async with cl.Step(name="Task Solver") as step:
+                        step.input = tool_call["args"]
+                        step.output = tool_call["result"]
+
+        plan = state.get("plan") if state else None
+        if plan and plan.tasks:
             # display sources after rerank
-            state["sources"] = await rerank(state["user_input"], state["sources"])
+            if deadline and deadline.below(0.2):
+                deadline.degrade("skip_rerank", f"{len(state['sources'])} sources")
+                state["sources"] = rank_by_score(state["sources"], k=5)
+            else:
+                scope.stage = "rerank"
+                state["sources"] = await rerank(state["user_input"], state["sources"])
+                scope.stage = "page_fetch"
+                state["sources"] = await fetch_pages(state["sources"])
             sources = "\n".join(
                 [f"[{i+1}] {source['url']}" for i, source in enumerate(state["sources"])])
             if sources:
                 async with cl.Step(name="Web Search Results", show_input=False) as step:
                     step.output = str(sources)
 
-    if state and state["plan"].tasks:
+    if plan and plan.tasks:
         logger.info("Invoke Task Summarizer")
+        scope.stage = "task_summarizer"
         task_summarizer = cast(
-            TaskSummarizer, cl.user_session.get("task-summarizer"))
+            "TaskSummarizer", cl.user_session.get("task-summarizer"))
         await task_summarizer(ai_msg, state)
         await ai_msg.send()
         history_cache.append(AIMessage(content=ai_msg.content))
-    elif state and not state["plan"].tasks:
+        if PREFETCH_ENABLED and not record:
+            # warm the caches for a likely follow-up while the user reads the answer
+            get_prefetcher().schedule(
+                cl.user_session.get("id"), state["plan"], state["sources"], state.get("category"))
+    elif plan:
         logger.info("Invoke Quick Responder")
+        scope.stage = "quick_responder"
         quick_responder = cast(
-            QuickResponder, cl.user_session.get("quick_responder"))
+            "QuickResponder", cl.user_session.get("quick_responder"))
         await quick_responder(ai_msg, state)
         await ai_msg.send()
         history_cache.append(AIMessage(content=ai_msg.content))
     else:
-        logger.error("state should not be None")
+        logger.error("plan should not be None")
 
     # update history
     cl.user_session.set("history-cache", history_cache)
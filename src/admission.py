@@ -0,0 +1,158 @@
+"""
+Admission control of the research pipelines.
+
+At most `ADMISSION_MAX_CONCURRENT` pipelines run at once, the following requests wait in a bounded FIFO queue.
+Requests which do not fit in the queue, or wait longer than `ADMISSION_QUEUE_TIMEOUT`, are not admitted
+and should be served by a cheaper path instead.
+"""
+
+import os
+import time
+import asyncio
+from collections import deque
+from typing import Awaitable, Callable, Optional
+
+from .logger import get_logger
+
+logger = get_logger("admission")
+
+# research pipelines running at once, 0 (the default) disables admission control
+ADMISSION_MAX_CONCURRENT = int(os.environ.get("ADMISSION_MAX_CONCURRENT", 0))
+# requests waiting for a pipeline
+ADMISSION_MAX_QUEUE = int(os.environ.get("ADMISSION_MAX_QUEUE", 16))
+# seconds a request waits in the queue before it is served by the fallback
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get("ADMISSION_QUEUE_TIMEOUT", 30))
+
+
+class _Waiter:
+    __slots__ = ("moved", "granted")
+
+    def __init__(self) -> None:
+        # set whenever the queue moves, the waiter checks its position or whether it was granted a slot
+        self.moved = asyncio.Event()
+        self.granted = False
+
+
+class AdmissionController:
+    """
+    Limits the concurrent research pipelines with a bounded wait queue.
+
+    Runs on the event loop of the app, so the gauges need no lock.
+    A released slot is handed over to the head of the queue directly, so queued requests are never overtaken.
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int = ADMISSION_MAX_CONCURRENT,
+        max_queue: int = ADMISSION_MAX_QUEUE,
+        queue_timeout: float = ADMISSION_QUEUE_TIMEOUT,
+    ) -> None:
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._waiters: deque[_Waiter] = deque()
+        self.in_flight = 0
+        self.counters = {
+            "admitted": 0,
+            "queued_total": 0,
+            "rejected": 0,
+            "timed_out": 0,
+        }
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_concurrent > 0
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    def _notify(self) -> None:
+        for waiter in self._waiters:
+            waiter.moved.set()
+
+    def _admitted(self, waited: float) -> bool:
+        self.counters["admitted"] += 1
+        self.wait_seconds_total += waited
+        self.wait_seconds_max = max(self.wait_seconds_max, waited)
+        return True
+
+    async def acquire(self, on_position: Optional[Callable[[int], Awaitable[None]]] = None) -> bool:
+        """
+        Wait for a pipeline slot, returns False if the request is not admitted.
+
+        `on_position` is awaited with the 1-based queue position whenever it changes while waiting.
+        A True result must be paired with `release`.
+        """
+        if not self.enabled:
+            self.in_flight += 1
+            return self._admitted(0.0)
+        if self.in_flight < self.max_concurrent and not self._waiters:
+            self.in_flight += 1
+            return self._admitted(0.0)
+        if len(self._waiters) >= self.max_queue:
+            self.counters["rejected"] += 1
+            logger.warning("Admission rejected with %d in flight and %d queued",
+                           self.in_flight, self.queued)
+            return False
+
+        waiter = _Waiter()
+        self._waiters.append(waiter)
+        self.counters["queued_total"] += 1
+        started = time.monotonic()
+        position = None
+        try:
+            while not waiter.granted:
+                if position != (new_position := self._waiters.index(waiter) + 1):
+                    position = new_position
+                    if on_position:
+                        await on_position(position)
+                    # the queue may have moved while the position was shown
+                    continue
+                waiter.moved.clear()
+                remaining = self.queue_timeout - (time.monotonic() - started)
+                await asyncio.wait_for(waiter.moved.wait(), max(remaining, 0))
+        except TimeoutError:
+            self._give_up(waiter)
+            self.counters["timed_out"] += 1
+            logger.warning("Admission timed out after %.2fs", time.monotonic() - started)
+            return False
+        except BaseException:
+            # cancelled, or `on_position` failed, e.g. the client is gone
+            self._give_up(waiter)
+            raise
+        return self._admitted(time.monotonic() - started)
+
+    def _give_up(self, waiter: _Waiter) -> None:
+        """Leave the queue, the slot is passed on if it was handed over right as the request gave up on it."""
+        if waiter.granted:
+            self.release()
+        else:
+            self._waiters.remove(waiter)
+            self._notify()
+
+    def release(self) -> None:
+        """Hand the slot over to the head of the queue, or free it."""
+        if self._waiters:
+            waiter = self._waiters.popleft()
+            waiter.granted = True
+            waiter.moved.set()
+            self._notify()
+        else:
+            self.in_flight -= 1
+
+    def snapshot(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            **self.counters,
+            "wait_seconds_total": round(self.wait_seconds_total, 3),
+            "wait_seconds_max": round(self.wait_seconds_max, 3),
+        }
+
+
+admission = AdmissionController()
@@ -0,0 +1,209 @@
+"""
+Answer questions in batch without the UI, for content generation and evaluation.
+
+Questions are read from JSONL, `{"id": "...", "question": "..."}` per line, the id defaults to the line number.
+Each answer is appended to the output JSONL as soon as it is done, so an interrupted run resumes
+by skipping the ids which already have an answer in the output. Failed questions are answered again,
+so the last line of an id is its result.
+
+    uv run -- python -m src.batch questions.jsonl --output answers.jsonl --concurrency 16
+
+Set `UPSTREAM_RATE_LIMITS` to stay within the upstream quotas, e.g. `bedrock=4,tavily=10,rerank=4`.
+"""
+
+import os
+import sys
+import json
+import asyncio
+import argparse
+from pathlib import Path
+from time import perf_counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Iterable, Optional
+
+from dotenv import load_dotenv
+
+# modules read their configuration at import time
+load_dotenv()
+
+from .logger import get_logger  # noqa: E402
+from .pipeline import ResearchPipeline  # noqa: E402
+
+logger = get_logger("batch")
+
+
+def load_questions(path: str) -> list[dict]:
+    questions = []
+    with open(path, encoding="utf-8") as f:
+        for i, line in enumerate(f):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            questions.append({
+                "id": str(item.get("id", i + 1)),
+                "question": item.get("question") or item["user_input"],
+            })
+    return questions
+
+
+def load_done(path: str) -> set[str]:
+    """Ids which already have an answer in the output, failed ones are answered again."""
+    if not os.path.exists(path):
+        return set()
+    done = set()
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                # the last line of an interrupted run may be incomplete
+                continue
+            if not result.get("error"):
+                done.add(result["id"])
+    return done
+
+
+class BatchRunner:
+    """
+    Answers questions with a bounded number of concurrent pipelines.
+
+    Every run shares the compiled graph, the model client and the module level caches and clients
+    (search cache, rerank cache, reranker, page fetcher), so repeated queries across questions are served once.
+    """
+
+    def __init__(self, pipeline: ResearchPipeline, concurrency: int = 8) -> None:
+        self.pipeline = pipeline
+        self.concurrency = concurrency
+
+    async def answer(self, question: dict) -> dict:
+        started = perf_counter()
+        try:
+            result = await self.pipeline.run(question["question"])
+        except Exception as e:
+            logger.warning("Question %s failed: %r", question["id"], e)
+            return {
+                "id": question["id"],
+                "question": question["question"],
+                "error": repr(e),
+                "latency": round(perf_counter() - started, 4),
+            }
+        state = result["state"]
+        plan = state.get("plan")
+        return {
+            "id": question["id"],
+            "question": question["question"],
+            "answer": result["answer"],
+            "category": state.get("category"),
+            "tasks": [task.title for task in plan.tasks] if plan else [],
+            "sources": [{"title": s["title"], "url": s["url"]} for s in state.get("sources", [])] if plan and plan.tasks else [],
+            "latency": round(perf_counter() - started, 4),
+            "timings": result["timings"],
+            "error": None,
+        }
+
+    async def run(self, questions: Iterable[dict]) -> AsyncIterator[dict]:
+        """Yield the results in completion order, at most `concurrency` questions are in progress at once."""
+        queue: asyncio.Queue[Optional[dict]] = asyncio.Queue(maxsize=self.concurrency)
+        results: asyncio.Queue[Optional[dict]] = asyncio.Queue()
+
+        async def worker() -> None:
+            # `answer` does not raise, a failed question is a result with an error
+            while (question := await queue.get()) is not None:
+                await results.put(await self.answer(question))
+
+        workers = [asyncio.create_task(worker()) for _ in range(self.concurrency)]
+
+        async def feed() -> None:
+            for question in questions:
+                await queue.put(question)
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+            await results.put(None)
+
+        feeder = asyncio.create_task(feed())
+        try:
+            while (result := await results.get()) is not None:
+                yield result
+            await feeder
+        finally:
+            feeder.cancel()
+            for task in workers:
+                task.cancel()
+
+
+async def run_batch(
+    questions: list[dict],
+    output: str,
+    pipeline: ResearchPipeline,
+    concurrency: int = 8,
+) -> dict:
+    """Answer the questions which are not answered in the output yet, and append their results to it."""
+    done = load_done(output)
+    pending = [q for q in questions if q["id"] not in done]
+    logger.info("%d questions, %d answered, %d to go", len(questions), len(done), len(pending))
+
+    # graph nodes and searches run on the default executor, size it for the concurrent pipelines
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=max(32, concurrency * 4)))
+
+    runner = BatchRunner(pipeline, concurrency=concurrency)
+    started = perf_counter()
+    answered, errors = 0, 0
+    Path(output).parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "a", encoding="utf-8") as f:
+        async for result in runner.run(pending):
+            f.write(json.dumps(result, ensure_ascii=False) + "\n")
+            f.flush()
+            if result["error"]:
+                errors += 1
+            else:
+                answered += 1
+    elapsed = perf_counter() - started
+    return {
+        "questions": len(questions),
+        "skipped": len(questions) - len(pending),
+        "answered": answered,
+        "errors": errors,
+        "elapsed": round(elapsed, 3),
+        "throughput": round(len(pending) / elapsed, 3) if elapsed > 0 else 0.0,
+    }
+
+
+def create_pipeline() -> ResearchPipeline:
+    """Create the pipeline with the same environment variables as the app."""
+    from .llm_tiering import create_node_models
+
+    aws_profile_name = os.environ.get("AWS_PROFILE_NAME", None)
+    aws_region = os.environ.get("AWS_REGION", None)
+    models = create_node_models(
+        os.environ.get("MODEL_ID", "us.anthropic.claude-3-5-haiku-20241022-v1:0"),
+        aws_profile_name=aws_profile_name,
+        aws_region=aws_region,
+        phoenix_project_name=os.environ.get("PHOENIX_PROJECT_NAME", "default"),
+        phoenix_endpoint=os.environ.get("PHOENIX_ENDPOINT", ""),
+    )
+    return ResearchPipeline(models, aws_profile_name=aws_profile_name, aws_region=aws_region)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("questions", help="JSONL file of questions")
+    parser.add_argument("--output", required=True,
+                        help="JSONL file to append the answers to, existing answers are skipped")
+    parser.add_argument("--concurrency", type=int, default=8,
+                        help="maximum number of questions answered at once")
+    args = parser.parse_args()
+
+    questions = load_questions(args.questions)
+    summary = asyncio.run(run_batch(
+        questions, args.output, create_pipeline(), concurrency=args.concurrency))
+
+    print(f"questions: {summary['questions']}, skipped: {summary['skipped']}, "
+          f"answered: {summary['answered']}, errors: {summary['errors']}")
+    print(f"elapsed: {summary['elapsed']:.2f}s, throughput: {summary['throughput']:.2f} q/s")
+    return 1 if summary["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,91 @@
+import time
+from threading import Lock
+from collections import OrderedDict
+from typing import Generic, Hashable, Optional, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+_MISSING = object()
+
+# origin of an entry which was cached ahead of demand, see `src.prefetcher`
+PREFETCH = "prefetch"
+
+
+class TTLCache(Generic[K, V]):
+    """
+    Thread-safe LRU cache whose entries expire `ttl` seconds after they are set.
+
+    `ttl=None` keeps entries until they are evicted by the LRU policy.
+    Entries set with `origin=PREFETCH` are accounted separately, to tell whether prefetching pays off:
+    the first hit of such entry counts as a prefetch hit, and an entry evicted or expired before any hit as wasted.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # key -> (expires_at, value, origin)
+        self._data: OrderedDict[K, tuple[float, V, Optional[str]]] = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.prefetched = 0
+        self.prefetch_hits = 0
+        self.prefetch_wasted = 0
+
+    def _expired(self, expires_at: float) -> bool:
+        return expires_at < time.monotonic()
+
+    def _drop(self, key: K) -> None:
+        _, _, origin = self._data.pop(key)
+        if origin == PREFETCH:
+            self.prefetch_wasted += 1
+
+    def get(self, key: K, default: Optional[V] = None) -> Optional[V]:
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING or self._expired(entry[0]):
+                if entry is not _MISSING:
+                    self._drop(key)
+                self.misses += 1
+                return default
+            expires_at, value, origin = entry
+            if origin == PREFETCH:
+                self.prefetch_hits += 1
+                self._data[key] = (expires_at, value, None)
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: K, value: V, origin: Optional[str] = None) -> None:
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else float("inf")
+        with self._lock:
+            if key in self._data:
+                self._drop(key)
+            self._data[key] = (expires_at, value, origin)
+            if origin == PREFETCH:
+                self.prefetched += 1
+            while len(self._data) > self.maxsize:
+                self._drop(next(iter(self._data)))
+                self.evictions += 1
+
+    def __contains__(self, key: K) -> bool:
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            return entry is not _MISSING and not self._expired(entry[0])
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "prefetched": self.prefetched,
+                "prefetch_hits": self.prefetch_hits,
+                "prefetch_wasted": self.prefetch_wasted,
+            }
@@ -0,0 +1,93 @@
+"""
+Cancellation of in-flight requests.
+
+Async code is cancelled with the asyncio task running the request,
+but sync nodes and searches run on worker threads which cannot be interrupted.
+They check the `CancelScope` of the request before every upstream call instead, so no further work starts once it is cancelled.
+"""
+
+from threading import Event, Lock
+from collections import Counter
+from contextvars import ContextVar
+from typing import Optional
+
+
+class RequestCancelled(Exception):
+    """The request was cancelled, e.g. the user stopped it, sent a new message or disconnected."""
+
+
+class CancelScope:
+    def __init__(self) -> None:
+        self._event = Event()
+        self.reason: Optional[str] = None
+        # the stage of the request, to account where the work was cancelled
+        self.stage = "start"
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self, reason: str) -> bool:
+        """Cancel the scope, returns False if it was already cancelled."""
+        if self._event.is_set():
+            return False
+        self.reason = reason
+        self._event.set()
+        return True
+
+    def check(self) -> None:
+        if self._event.is_set():
+            raise RequestCancelled(self.reason)
+
+
+current_scope: ContextVar[Optional[CancelScope]] = ContextVar(
+    "current_scope", default=None)
+
+
+def check_cancelled() -> None:
+    """Raise `RequestCancelled` if the request of the current context has been cancelled."""
+    scope = current_scope.get()
+    if scope:
+        scope.check()
+
+
+class CancellationStats:
+    """Counts the cancelled requests and the upstream work which was not done because of them."""
+
+    def __init__(self) -> None:
+        self._lock = Lock()
+        self.requests = Counter()
+        self.stages = Counter()
+        self.upstream_calls_skipped = Counter()
+        self.search_queries_cancelled = 0
+        self.streams_aborted = 0
+
+    def cancelled(self, scope: CancelScope) -> None:
+        with self._lock:
+            self.requests[scope.reason or "unknown"] += 1
+            self.stages[scope.stage] += 1
+
+    def skipped(self, kind: str) -> None:
+        with self._lock:
+            self.upstream_calls_skipped[kind] += 1
+
+    def search_cancelled(self, queries: int) -> None:
+        with self._lock:
+            self.search_queries_cancelled += queries
+
+    def stream_aborted(self) -> None:
+        with self._lock:
+            self.streams_aborted += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "requests": dict(self.requests),
+                "stages": dict(self.stages),
+                "upstream_calls_skipped": dict(self.upstream_calls_skipped),
+                "search_queries_cancelled": self.search_queries_cancelled,
+                "streams_aborted": self.streams_aborted,
+            }
+
+
+cancel_stats = CancellationStats()
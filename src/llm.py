@@ -1,9 +1,23 @@
 import os
+from functools import cache
 from typing import Optional
 
 from langchain_aws.chat_models import ChatBedrockConverse
-from openinference.instrumentation.langchain import LangChainInstrumentor
-from phoenix.otel import register
+
+
+@cache
+def _setup_tracing(phoenix_project_name: Optional[str], phoenix_endpoint: str) -> None:
+    """Instrument LangChain once, however many models are created."""
+    # tracing is optional, import phoenix and openinference only when it is enabled
+    from openinference.instrumentation.langchain import LangChainInstrumentor
+    from phoenix.otel import register
+
+    # initialize Phoenix tracer
+    tracer_provider = register(
+        project_name=phoenix_project_name,
+        endpoint=phoenix_endpoint,
+    )
+    LangChainInstrumentor().instrument(tracer_provider=tracer_provider)
 
 
 class BedrockLLM(object):
@@ -18,12 +32,7 @@ class BedrockLLM(object):
         phoenix_endpoint: Optional[str] = None,
     ):
         if os.getenv("ENABLE_TRACING", "false").lower() == "true" and phoenix_endpoint:
-            # initialize Phoenix tracer
-            tracer_provider = register(
-                project_name=phoenix_project_name,
-                endpoint=phoenix_endpoint,
-            )
-            LangChainInstrumentor().instrument(tracer_provider=tracer_provider)
+            _setup_tracing(phoenix_project_name, phoenix_endpoint)
 
         self.model = ChatBedrockConverse(
             model=model,
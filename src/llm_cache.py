@@ -0,0 +1,242 @@
+"""
+Exact-match cache of LLM responses for deterministic node calls, opt-in per node with `LLM_CACHE_NODES`.
+
+Prompts are byte-identical for repeated questions and retries apart from the current datetime inserted into them,
+so the cache key is the hash of the canonical prompt with every ISO timestamp truncated to `LLM_CACHE_TIME_GRANULARITY`.
+Responses are kept in memory, and in a sqlite file as well if `LLM_CACHE_PATH` is set, to survive restarts.
+The cache is looked up before `upstream.call`, so a hit is not rate limited. It is not used while a workload is recorded
+or replayed (see `upstream.caches_enabled`), so recordings hold every response of the conversation.
+"""
+
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+from threading import Lock
+from functools import cache
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Any, Callable, Optional, Protocol, TypeVar
+
+from langchain_core.prompt_values import PromptValue
+
+from . import upstream
+from .cache import TTLCache
+from .llm_tiering import answered_by_fallback
+from .logger import get_logger
+from .workload.recording import identity
+
+logger = get_logger("llm_cache")
+
+T = TypeVar("T")
+
+# nodes whose responses are cached, e.g. `semantic_router,structured_planner`
+LLM_CACHE_NODES = {n.strip() for n in os.environ.get("LLM_CACHE_NODES", "").split(",") if n.strip()}
+LLM_CACHE_TTL = float(os.environ.get("LLM_CACHE_TTL", 3600))
+LLM_CACHE_MAXSIZE = int(os.environ.get("LLM_CACHE_MAXSIZE", 1024))
+# seconds, timestamps in the prompt within the same window share the cache entry
+LLM_CACHE_TIME_GRANULARITY = int(os.environ.get("LLM_CACHE_TIME_GRANULARITY", 3600))
+# sqlite file to persist the cache, memory only if not set
+LLM_CACHE_PATH = os.environ.get("LLM_CACHE_PATH", "")
+
+ISO_TIMESTAMP = re.compile(
+    r"\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(?:\.\d+)?(?:Z|[+-]\d{2}:\d{2})?")
+
+
+class CacheBackend(Protocol):
+    """Storage of encoded responses by key, returns None on a miss."""
+
+    def get(self, key: str) -> Optional[str]: ...
+
+    def set(self, key: str, value: str) -> None: ...
+
+
+class SqliteBackend:
+    """LRU and TTL cache in a local sqlite file, shared by processes on the same host."""
+
+    def __init__(self, path: str, maxsize: int = LLM_CACHE_MAXSIZE * 10, ttl: float = LLM_CACHE_TTL) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # nodes run on worker threads, the connection is shared under the lock
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache "
+            "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, used_at REAL NOT NULL)")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS llm_cache_used_at ON llm_cache (used_at)")
+        self._lock = Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if not row:
+                return None
+            if row[1] < now:
+                self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                return None
+            self._conn.execute(
+                "UPDATE llm_cache SET used_at = ? WHERE key = ?", (now, key))
+            return row[0]
+
+    def set(self, key: str, value: str) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache VALUES (?, ?, ?, ?)",
+                (key, value, now + self.ttl, now))
+            # evict expired entries, then the least recently used beyond maxsize
+            self._conn.execute("DELETE FROM llm_cache WHERE expires_at < ?", (now,))
+            self._conn.execute(
+                "DELETE FROM llm_cache WHERE key IN "
+                "(SELECT key FROM llm_cache ORDER BY used_at DESC LIMIT -1 OFFSET ?)",
+                (self.maxsize,))
+
+
+class LLMCacheStats:
+    def __init__(self) -> None:
+        self._lock = Lock()
+        self.hits = Counter()
+        self.disk_hits = Counter()
+        self.misses = Counter()
+
+    def count(self, counter: Counter, node: str) -> None:
+        with self._lock:
+            counter[node] += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "hits": dict(self.hits),
+                "disk_hits": dict(self.disk_hits),
+                "misses": dict(self.misses),
+            }
+
+
+llm_cache_stats = LLMCacheStats()
+# shared by the nodes of every session
+memory_cache: TTLCache[str, str] = TTLCache(maxsize=LLM_CACHE_MAXSIZE, ttl=LLM_CACHE_TTL)
+
+
+@cache
+def get_disk_backend() -> Optional[CacheBackend]:
+    return SqliteBackend(LLM_CACHE_PATH) if LLM_CACHE_PATH else None
+
+
+def _truncate_timestamp(match: re.Match, granularity: int) -> str:
+    try:
+        ts = datetime.fromisoformat(match.group(0).replace("Z", "+00:00"))
+    except ValueError:
+        return match.group(0)
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    epoch = int(ts.timestamp()) // granularity * granularity
+    return datetime.fromtimestamp(epoch, timezone.utc).isoformat()
+
+
+def canonical_prompt(prompt: Any, granularity: int = LLM_CACHE_TIME_GRANULARITY) -> str:
+    """Message types and contents of the prompt, with the timestamps truncated to the granularity."""
+    messages = prompt.to_messages() if isinstance(prompt, PromptValue) else prompt
+    if isinstance(messages, str):
+        text = messages
+    else:
+        text = json.dumps(
+            [[m.type, m.content] for m in messages], ensure_ascii=False, sort_keys=True)
+    if granularity > 0:
+        text = ISO_TIMESTAMP.sub(lambda m: _truncate_timestamp(m, granularity), text)
+    return text
+
+
+class ResponseCache:
+    """
+    Cache of the responses of a node, looked up before the upstream call so a hit is not rate limited nor recorded.
+
+    `namespace` tells apart the models and output schemas sharing the cache, `encode` and `decode` convert the response to and from JSON.
+    """
+
+    def __init__(
+        self,
+        node: str,
+        namespace: str,
+        encode: Callable[[Any], Any] = identity,
+        decode: Callable[[Any], Any] = identity,
+        backend: Optional[CacheBackend] = None,
+    ) -> None:
+        self.node = node
+        self.namespace = namespace
+        self.encode = encode
+        self.decode = decode
+        self.backend = backend
+
+    def key(self, prompt: Any) -> str:
+        digest = hashlib.sha256(canonical_prompt(prompt).encode("utf-8")).hexdigest()
+        return f"{self.node}:{self.namespace}:{digest}"
+
+    def get(self, key: str) -> Optional[Any]:
+        value = memory_cache.get(key)
+        if value is not None:
+            llm_cache_stats.count(llm_cache_stats.hits, self.node)
+            return self.decode(json.loads(value))
+        if self.backend:
+            value = self.backend.get(key)
+            if value is not None:
+                llm_cache_stats.count(llm_cache_stats.disk_hits, self.node)
+                memory_cache.set(key, value)
+                return self.decode(json.loads(value))
+        llm_cache_stats.count(llm_cache_stats.misses, self.node)
+        return None
+
+    def set(self, key: str, response: Any) -> None:
+        value = json.dumps(self.encode(response), ensure_ascii=False)
+        memory_cache.set(key, value)
+        if self.backend:
+            self.backend.set(key, value)
+
+    def call(self, prompt: Any, fn: Callable[[], T]) -> T:
+        """Serve the prompt from the cache, or call `fn` (the upstream call of the node) and cache its response unless the fallback model answered."""
+        key = self.key(prompt)
+        response = self.get(key)
+        if response is not None:
+            return response
+        token = answered_by_fallback.set(False)
+        try:
+            response = fn()
+            # the namespace is the one of the primary model
+            if not answered_by_fallback.get():
+                self.set(key, response)
+        finally:
+            answered_by_fallback.reset(token)
+        return response
+
+
+def cached(
+    node: str,
+    model: Any,
+    schema: str,
+    encode: Callable[[Any], Any] = identity,
+    decode: Callable[[Any], Any] = identity,
+) -> Optional[ResponseCache]:
+    """Cache of the responses of the node, None if the node is not listed in `LLM_CACHE_NODES`."""
+    if node not in LLM_CACHE_NODES:
+        return None
+    model_id = getattr(model, "model_id", None) or type(model).__name__
+    temperature = getattr(model, "temperature", None)
+    logger.info("LLM cache enabled for %s", node)
+    return ResponseCache(
+        node,
+        namespace=f"{model_id}:{temperature}:{schema}",
+        encode=encode,
+        decode=decode,
+        backend=get_disk_backend(),
+    )
+
+
+def cached_call(cache: Optional[ResponseCache], prompt: Any, fn: Callable[[], T]) -> T:
+    """Call `fn` through the cache of the node if it has one."""
+    return cache.call(prompt, fn) if cache and upstream.caches_enabled() else fn()
@@ -0,0 +1,384 @@
+"""
+Per-node model tiering with latency-aware fallback.
+
+Each node may use its own model, temperature and max_tokens, e.g. a small fast model for `semantic_router` and `task_solver`,
+configured by `<NODE>_MODEL_ID`, `<NODE>_TEMPERATURE`, `<NODE>_MAX_TOKENS` and `<NODE>_FALLBACK_MODEL_ID`, falling back to
+`MODEL_ID` and `FALLBACK_MODEL_ID`.
+
+A call which fails is retried on the fallback model right away. A circuit breaker per node watches the latency and the errors
+of the primary model, and sends every call to the fallback model for a while once they cross the thresholds.
+The latency, tokens and cost of each node are reported separately by a callback handler.
+"""
+
+import os
+import time
+import statistics
+from threading import Lock
+from functools import cache
+from collections import deque
+from contextvars import ContextVar
+from time import perf_counter
+from typing import Any, AsyncIterator, Callable, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.outputs import LLMResult
+
+from .llm import BedrockLLM
+from .cancellation import RequestCancelled
+from .logger import get_logger
+
+logger = get_logger("llm_tiering")
+
+NODES = ("semantic_router", "structured_planner", "task_solver", "task_summarizer", "quick_responder")
+
+FALLBACK_MODEL_ID = os.environ.get("FALLBACK_MODEL_ID", "")
+# the breaker opens when the median latency of the recent calls exceeds this many seconds,
+# the first token is considered for streamed calls
+MODEL_FALLBACK_LATENCY = float(os.environ.get("MODEL_FALLBACK_LATENCY", 10))
+# or when this fraction of the recent calls failed
+MODEL_FALLBACK_ERROR_RATE = float(os.environ.get("MODEL_FALLBACK_ERROR_RATE", 0.5))
+# recent calls of the primary model which the breaker considers
+MODEL_FALLBACK_WINDOW = int(os.environ.get("MODEL_FALLBACK_WINDOW", 20))
+# seconds the fallback model serves every call before the primary model is tried again
+MODEL_FALLBACK_COOLDOWN = float(os.environ.get("MODEL_FALLBACK_COOLDOWN", 30))
+# USD per million input and output tokens by model, e.g. `model-a=0.8:4,model-b=0.25:1.25`
+MODEL_PRICES = os.environ.get("MODEL_PRICES", "")
+
+# the breaker does not judge the model on fewer calls than this
+MIN_CALLS = 5
+
+# set by `FallbackRunnable` in the context of the caller when the fallback model answered,
+# e.g. so the response is not cached as the one of the primary model
+answered_by_fallback: ContextVar[bool] = ContextVar("answered_by_fallback", default=False)
+
+
+def _parse_prices(value: str) -> dict[str, tuple[float, float]]:
+    prices = {}
+    for item in filter(None, (i.strip() for i in value.split(","))):
+        model_id, _, price = item.rpartition("=")
+        input_price, _, output_price = price.partition(":")
+        prices[model_id.strip()] = (float(input_price), float(output_price or input_price))
+    return prices
+
+
+PRICES = _parse_prices(MODEL_PRICES)
+
+
+class NodeModelStats:
+    """Calls, latency, tokens and cost by node and model, and fallbacks by node."""
+
+    def __init__(self) -> None:
+        self._lock = Lock()
+        self._models: dict[tuple[str, str], dict] = {}
+        self._nodes: dict[str, dict] = {}
+
+    def _node(self, node: str) -> dict:
+        return self._nodes.setdefault(node, {"errors": 0, "fallbacks": 0, "breaker_opened": 0})
+
+    def count(self, node: str, name: str) -> None:
+        with self._lock:
+            self._node(node)[name] += 1
+
+    def record(self, node: str, model_id: str, latency: float, input_tokens: int, output_tokens: int) -> None:
+        input_price, output_price = PRICES.get(model_id, (0.0, 0.0))
+        with self._lock:
+            stats = self._models.setdefault((node, model_id), {
+                "calls": 0, "latency_total": 0.0, "latency_max": 0.0,
+                "input_tokens": 0, "output_tokens": 0, "cost": 0.0,
+            })
+            stats["calls"] += 1
+            stats["latency_total"] += latency
+            stats["latency_max"] = max(stats["latency_max"], latency)
+            stats["input_tokens"] += input_tokens
+            stats["output_tokens"] += output_tokens
+            stats["cost"] += (input_tokens * input_price + output_tokens * output_price) / 1_000_000
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            nodes = {node: dict(stats) for node, stats in self._nodes.items()}
+            for (node, model_id), stats in self._models.items():
+                models = nodes.setdefault(node, dict(self._node(node))).setdefault("models", {})
+                models[model_id] = {
+                    **stats,
+                    "latency_total": round(stats["latency_total"], 3),
+                    "latency_max": round(stats["latency_max"], 3),
+                    "latency_avg": round(stats["latency_total"] / stats["calls"], 3),
+                    "cost": round(stats["cost"], 6),
+                }
+            return nodes
+
+
+node_stats = NodeModelStats()
+
+
+class UsageHandler(BaseCallbackHandler):
+    """Reports the latency and token usage of every call of the model to `node_stats`."""
+
+    def __init__(self, node: str, model_id: str) -> None:
+        self.node = node
+        self.model_id = model_id
+        self._started: dict[UUID, float] = {}
+
+    def on_chat_model_start(self, serialized: dict, messages: list, *, run_id: UUID, **kwargs: Any) -> None:
+        self._started[run_id] = perf_counter()
+
+    def on_llm_start(self, serialized: dict, prompts: list[str], *, run_id: UUID, **kwargs: Any) -> None:
+        self._started[run_id] = perf_counter()
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:
+        started = self._started.pop(run_id, None)
+        input_tokens, output_tokens = 0, 0
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                input_tokens += usage.get("input_tokens", 0)
+                output_tokens += usage.get("output_tokens", 0)
+        latency = perf_counter() - started if started is not None else 0.0
+        node_stats.record(self.node, self.model_id, latency, input_tokens, output_tokens)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._started.pop(run_id, None)
+
+
+class CircuitBreaker:
+    """
+    Closed while the primary model is healthy. Opens when the median latency or the error rate of the recent calls
+    crosses the thresholds, then lets a single probe call through after the cooldown, which closes it again on success.
+    """
+
+    def __init__(
+        self,
+        node: str,
+        latency_threshold: float = MODEL_FALLBACK_LATENCY,
+        error_rate_threshold: float = MODEL_FALLBACK_ERROR_RATE,
+        window: int = MODEL_FALLBACK_WINDOW,
+        cooldown: float = MODEL_FALLBACK_COOLDOWN,
+    ) -> None:
+        self.node = node
+        self.latency_threshold = latency_threshold
+        self.error_rate_threshold = error_rate_threshold
+        self.cooldown = cooldown
+        # (latency, failed) of the recent calls of the primary model
+        self._calls: deque[tuple[float, bool]] = deque(maxlen=window)
+        self._opened_at: Optional[float] = None
+        self._probing = False
+        self._lock = Lock()
+
+    def allow(self) -> bool:
+        """Whether the call may go to the primary model."""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._probing or time.monotonic() - self._opened_at < self.cooldown:
+                return False
+            self._probing = True
+            return True
+
+    def abandon(self) -> None:
+        """The call was cancelled before its outcome was known, a probe call lets the next one through."""
+        with self._lock:
+            self._probing = False
+
+    def record(self, latency: float, failed: bool) -> None:
+        with self._lock:
+            if self._opened_at is not None:
+                # result of the probe call
+                self._probing = False
+                if failed or latency > self.latency_threshold:
+                    self._opened_at = time.monotonic()
+                else:
+                    logger.info("Circuit of %s closed", self.node)
+                    self._opened_at = None
+                    self._calls.clear()
+                return
+            self._calls.append((latency, failed))
+            if len(self._calls) < MIN_CALLS:
+                return
+            error_rate = sum(failed for _, failed in self._calls) / len(self._calls)
+            median_latency = statistics.median(latency for latency, failed in self._calls if not failed) \
+                if error_rate < 1 else 0.0
+            if error_rate >= self.error_rate_threshold or median_latency > self.latency_threshold:
+                logger.warning("Circuit of %s opened, error rate %.2f, median latency %.2fs",
+                               self.node, error_rate, median_latency)
+                self._opened_at = time.monotonic()
+                node_stats.count(self.node, "breaker_opened")
+
+
+class FallbackRunnable:
+    """
+    Runs `invoke` and `astream` on the primary runnable, or on the fallback runnable when it fails or the breaker is open.
+
+    Without a fallback runnable, every call goes to the primary runnable and the breaker is not used.
+    """
+
+    def __init__(self, node: str, primary: Any, fallback: Optional[Any], breaker: CircuitBreaker) -> None:
+        self.node = node
+        self.primary = primary
+        self.fallback = fallback
+        self.breaker = breaker
+
+    def _use_primary(self) -> bool:
+        if self.fallback is None or self.breaker.allow():
+            return True
+        node_stats.count(self.node, "fallbacks")
+        return False
+
+    def _record(self, started: float, failed: bool) -> None:
+        if self.fallback is not None:
+            self.breaker.record(perf_counter() - started, failed)
+
+    def _abandon(self) -> None:
+        if self.fallback is not None:
+            self.breaker.abandon()
+
+    def _failed(self, started: float, e: Exception) -> None:
+        node_stats.count(self.node, "errors")
+        if self.fallback is None:
+            raise e
+        self._record(started, True)
+        node_stats.count(self.node, "fallbacks")
+        logger.warning("Model of %s failed, falling back: %r", self.node, e)
+
+    def invoke(self, input: Any, *args: Any, **kwargs: Any) -> Any:
+        if self._use_primary():
+            started = perf_counter()
+            try:
+                result = self.primary.invoke(input, *args, **kwargs)
+            except RequestCancelled:
+                self._abandon()
+                raise
+            except Exception as e:
+                self._failed(started, e)
+            except BaseException:
+                self._abandon()
+                raise
+            else:
+                self._record(started, False)
+                return result
+        answered_by_fallback.set(True)
+        return self.fallback.invoke(input, *args, **kwargs)
+
+    async def astream(self, input: Any, *args: Any, **kwargs: Any) -> AsyncIterator[Any]:
+        if self._use_primary():
+            started = perf_counter()
+            first_chunk = True
+            try:
+                async for chunk in self.primary.astream(input, *args, **kwargs):
+                    if first_chunk:
+                        first_chunk = False
+                        self._record(started, False)
+                    yield chunk
+                if first_chunk:
+                    self._record(started, False)
+                return
+            except RequestCancelled:
+                if first_chunk:
+                    self._abandon()
+                raise
+            except Exception as e:
+                if not first_chunk:
+                    # part of the answer has been sent already
+                    node_stats.count(self.node, "errors")
+                    raise
+                self._failed(started, e)
+            except BaseException:
+                # cancelled or closed, e.g. the user stopped the request, the call is neither healthy nor failed
+                if first_chunk:
+                    self._abandon()
+                raise
+        answered_by_fallback.set(True)
+        async for chunk in self.fallback.astream(input, *args, **kwargs):
+            yield chunk
+
+
+def _model_id(model: Any) -> str:
+    return getattr(model, "model_id", None) or type(model).__name__
+
+
+class TieredModel:
+    """
+    The model of a node, used by the node like a chat model.
+
+    `with_structured_output`, `bind_tools` and `with_config` are applied to both the primary and the fallback model.
+    Other attributes, e.g. `model_id`, are the ones of the primary model.
+    """
+
+    def __init__(self, node: str, primary: BaseChatModel, fallback: Optional[BaseChatModel] = None) -> None:
+        self.node = node
+        self.primary = primary
+        self.fallback = fallback
+        self.breaker = CircuitBreaker(node)
+
+    def _derive(self, fn: Callable[[Any], Any]) -> FallbackRunnable:
+        def with_usage(model: BaseChatModel) -> Any:
+            return fn(model).with_config(callbacks=[UsageHandler(self.node, _model_id(model))])
+
+        return FallbackRunnable(
+            self.node,
+            with_usage(self.primary),
+            with_usage(self.fallback) if self.fallback is not None else None,
+            self.breaker,
+        )
+
+    def with_structured_output(self, *args: Any, **kwargs: Any) -> FallbackRunnable:
+        return self._derive(lambda m: m.with_structured_output(*args, **kwargs))
+
+    def bind_tools(self, *args: Any, **kwargs: Any) -> FallbackRunnable:
+        return self._derive(lambda m: m.bind_tools(*args, **kwargs))
+
+    def with_config(self, *args: Any, **kwargs: Any) -> FallbackRunnable:
+        return self._derive(lambda m: m.with_config(*args, **kwargs))
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.primary, name)
+
+
+class NodeModels:
+    """Models by node, nodes which are not configured use the default model."""
+
+    def __init__(self, default: Any, models: Optional[dict[str, Any]] = None) -> None:
+        self.default = default
+        self.models = models or {}
+
+    def __getitem__(self, node: str) -> Any:
+        return self.models.get(node, self.default)
+
+
+def _node_env(node: str, name: str, default: str) -> str:
+    return os.environ.get(f"{node.upper()}_{name}", "") or default
+
+
+def create_node_models(
+    model_id: str,
+    aws_profile_name: Optional[str] = None,
+    aws_region: Optional[str] = None,
+    phoenix_project_name: Optional[str] = None,
+    phoenix_endpoint: Optional[str] = None,
+) -> NodeModels:
+    """Create the model of each node from the environment variables, nodes with the same settings share the client."""
+
+    @cache
+    def bedrock(model: str, temperature: float, max_tokens: int) -> BaseChatModel:
+        return BedrockLLM(
+            model=model,
+            aws_profile_name=aws_profile_name,
+            aws_region=aws_region,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            phoenix_project_name=phoenix_project_name,
+            phoenix_endpoint=phoenix_endpoint,
+        ).model
+
+    models = {}
+    for node in NODES:
+        temperature = float(_node_env(node, "TEMPERATURE", "0.3"))
+        max_tokens = int(_node_env(node, "MAX_TOKENS", str(1024 * 2)))
+        primary = bedrock(_node_env(node, "MODEL_ID", model_id), temperature, max_tokens)
+        fallback_id = _node_env(node, "FALLBACK_MODEL_ID", FALLBACK_MODEL_ID)
+        fallback = bedrock(fallback_id, temperature, max_tokens) if fallback_id else None
+        models[node] = TieredModel(node, primary, fallback)
+        logger.info("Model of %s: %s, fallback: %s", node,
+                    _model_id(primary), _model_id(fallback) if fallback else None)
+    return NodeModels(None, models)
@@ -0,0 +1,85 @@
+"""
+Incrementally index pre-crawled documents into the local index.
+
+Inputs are JSONL files with `{title, url, content}` per line, or directories of `.md`/`.txt` files.
+Only new or changed documents are indexed, as a new segment.
+
+    uv run -- python -m src.local_index.build --index-dir data/index crawled/wiki.jsonl crawled/patch-notes/
+    uv run -- python -m src.local_index.build --index-dir data/index --compact
+"""
+
+import sys
+import json
+import argparse
+from pathlib import Path
+from time import perf_counter
+from typing import Iterable, Optional
+
+from .index import Embedder, LocalIndex
+
+
+def get_embedder(model_id: str, aws_profile_name: Optional[str] = None, aws_region: Optional[str] = None) -> Embedder:
+    """Bedrock embeddings for the optional vector search."""
+    from langchain_aws import BedrockEmbeddings
+
+    embeddings = BedrockEmbeddings(
+        model_id=model_id,
+        credentials_profile_name=aws_profile_name,
+        region_name=aws_region,
+    )
+    return embeddings.embed_documents
+
+
+def read_documents(path: Path) -> Iterable[dict]:
+    if path.is_dir():
+        for file in sorted(path.rglob("*")):
+            if file.suffix in (".md", ".txt"):
+                yield {
+                    "title": file.stem,
+                    "url": file.resolve().as_uri(),
+                    "content": file.read_text(encoding="utf-8"),
+                }
+    else:
+        with path.open(encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    doc = json.loads(line)
+                    yield {"title": doc.get("title", ""), "url": doc["url"], "content": doc["content"]}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("inputs", nargs="*", type=Path,
+                        help="JSONL files or directories of .md/.txt files")
+    parser.add_argument("--index-dir", required=True, help="index directory")
+    parser.add_argument("--compact", action="store_true",
+                        help="merge every segment into one after indexing")
+    parser.add_argument("--embedding-model",
+                        help="Bedrock embedding model ID for vector search, e.g. amazon.titan-embed-text-v2:0")
+    parser.add_argument("--aws-profile-name")
+    parser.add_argument("--aws-region")
+    args = parser.parse_args()
+
+    embed = get_embedder(args.embedding_model, args.aws_profile_name,
+                         args.aws_region) if args.embedding_model else None
+    index = LocalIndex(args.index_dir)
+
+    started = perf_counter()
+    docs = [doc for path in args.inputs for doc in read_documents(path)]
+    indexed = index.add(docs, embed)
+    print(f"indexed {indexed} of {len(docs)} documents in {perf_counter() - started:.2f}s")
+
+    if args.compact:
+        started = perf_counter()
+        try:
+            live = index.compact(embed)
+        except ValueError as e:
+            print(f"cannot compact: {e}", file=sys.stderr)
+            return 1
+        print(f"compacted {live} documents in {perf_counter() - started:.2f}s")
+    print(f"segments: {len(index.view.segments)}, documents: {index.view.num_docs}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,383 @@
+"""
+Local document index with BM25 over inverted index segments and optional vector search.
+
+An index directory consists of a manifest and immutable segments, each indexing run appends a new segment:
+
+    manifest.json       {"version": 3, "segments": ["seg-000001", "seg-000002", ...]}
+    seg-000001/
+        meta.json       {"num_docs": 120, "total_len": 53120, "dim": 1024}
+        lexicon.json    {term: [postings offset, document frequency]}
+        postings.bin    uint32 pairs of (doc id, term frequency)
+        doclens.bin     uint32 document length per doc id
+        docs.jsonl      {"title", "url", "content", "hash"} per line
+        docoffsets.bin  uint64 byte offset of each line of docs.jsonl
+        vectors.f32     optional float32 embeddings of the documents, num_docs x dim
+
+The postings, document lengths, documents and vectors are memory-mapped, only the lexicon of each segment is
+loaded into memory. When a URL is indexed again, the document of the newest segment shadows the older ones.
+"""
+
+import re
+import json
+import math
+import heapq
+import shutil
+import hashlib
+from mmap import mmap, ACCESS_READ
+from array import array
+from pathlib import Path
+from threading import Lock
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Callable, Iterable, Optional, Sequence
+
+Embedder = Callable[[list[str]], list[list[float]]]
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> list[str]:
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def document_hash(doc: dict) -> str:
+    return hashlib.sha1(
+        f"{doc['url']}\n{doc.get('title', '')}\n{doc['content']}".encode("utf-8")).hexdigest()
+
+
+def _map(path: Path, typecode: str) -> memoryview:
+    """Memory-map a binary file as a read-only array of the given type."""
+    if not path.exists() or path.stat().st_size == 0:
+        return memoryview(array(typecode))
+    with path.open("rb") as f:
+        return memoryview(mmap(f.fileno(), 0, access=ACCESS_READ)).cast(typecode)
+
+
+class Segment:
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.meta = json.loads((path / "meta.json").read_text())
+        self.lexicon: dict[str, list[int]] = json.loads(
+            (path / "lexicon.json").read_text())
+        self.postings = _map(path / "postings.bin", "I")
+        self.doclens = _map(path / "doclens.bin", "I")
+        self.offsets = _map(path / "docoffsets.bin", "Q")
+        self._docs = _map(path / "docs.jsonl", "B")
+        self._vectors = None
+        self._raw_vectors: Optional[memoryview] = None
+
+    @property
+    def num_docs(self) -> int:
+        return self.meta["num_docs"]
+
+    def doc(self, doc_id: int) -> dict:
+        start = self.offsets[doc_id]
+        end = self.offsets[doc_id + 1] if doc_id + 1 < self.num_docs else len(self._docs)
+        return json.loads(bytes(self._docs[start:end]))
+
+    def docs(self) -> Iterable[tuple[int, dict]]:
+        for doc_id in range(self.num_docs):
+            yield doc_id, self.doc(doc_id)
+
+    def postings_of(self, term: str) -> memoryview:
+        offset, df = self.lexicon.get(term, (0, 0))
+        return self.postings[offset * 2:(offset + df) * 2]
+
+    def vectors(self):
+        """Document embeddings as a (num_docs, dim) numpy array, None if the segment has none."""
+        if self._vectors is None and self.meta.get("dim"):
+            import numpy as np
+
+            path = self.path / "vectors.f32"
+            with path.open("rb") as f:
+                buffer = mmap(f.fileno(), 0, access=ACCESS_READ)
+            self._vectors = np.frombuffer(buffer, dtype=np.float32).reshape(
+                self.num_docs, self.meta["dim"])
+        return self._vectors
+
+    def vector(self, doc_id: int) -> Optional[memoryview]:
+        """Normalized embedding of the document without numpy, None if the segment has none."""
+        dim = self.meta.get("dim")
+        if not dim:
+            return None
+        if self._raw_vectors is None:
+            self._raw_vectors = _map(self.path / "vectors.f32", "f")
+        return self._raw_vectors[doc_id * dim:(doc_id + 1) * dim]
+
+
+def write_segment(
+    path: Path,
+    docs: list[dict],
+    embed: Optional[Embedder] = None,
+    vectors: Optional[list[Sequence[float]]] = None,
+) -> None:
+    """
+    Write the documents as an immutable segment.
+
+    The documents are embedded with `embed`, or `vectors` are their normalized embeddings already, e.g. copied by `compact`.
+    """
+    path.mkdir(parents=True, exist_ok=True)
+
+    inverted: dict[str, list[tuple[int, int]]] = {}
+    doclens = array("I")
+    offsets = array("Q")
+    with (path / "docs.jsonl").open("wb") as f:
+        for doc_id, doc in enumerate(docs):
+            tokens = tokenize(f"{doc.get('title', '')} {doc['content']}")
+            doclens.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                inverted.setdefault(term, []).append((doc_id, tf))
+            offsets.append(f.tell())
+            record = {
+                "title": doc.get("title", ""),
+                "url": doc["url"],
+                "content": doc["content"],
+                "hash": doc.get("hash") or document_hash(doc),
+            }
+            f.write(json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n")
+
+    lexicon = {}
+    postings = array("I")
+    for term, entries in inverted.items():
+        lexicon[term] = [len(postings) // 2, len(entries)]
+        for doc_id, tf in entries:
+            postings.append(doc_id)
+            postings.append(tf)
+
+    meta = {"num_docs": len(docs), "total_len": sum(doclens), "dim": 0}
+    if embed and docs:
+        vectors = []
+        for embedding in embed([f"{d.get('title', '')}\n{d['content']}" for d in docs]):
+            norm = math.sqrt(sum(v * v for v in embedding)) or 1.0
+            vectors.append([v / norm for v in embedding])
+    if vectors and docs:
+        data = array("f")
+        for vector in vectors:
+            data.extend(vector)
+        meta["dim"] = len(vectors[0])
+        (path / "vectors.f32").write_bytes(data.tobytes())
+
+    (path / "postings.bin").write_bytes(postings.tobytes())
+    (path / "doclens.bin").write_bytes(doclens.tobytes())
+    (path / "docoffsets.bin").write_bytes(offsets.tobytes())
+    (path / "lexicon.json").write_text(json.dumps(lexicon, ensure_ascii=False))
+    (path / "meta.json").write_text(json.dumps(meta))
+
+
+@dataclass
+class _View:
+    """Segments of a manifest version with the shadowed documents and collection statistics."""
+
+    segments: list[Segment] = field(default_factory=list)
+    deleted: list[set[int]] = field(default_factory=list)
+    hashes: set[str] = field(default_factory=set)
+    num_docs: int = 0
+    avgdl: float = 0.0
+
+
+class LocalIndex:
+    """
+    LocalIndex searches the segments with BM25, optionally blended with cosine similarity of the embeddings.
+
+    Results have the same shape as Tavily results, `{title, url, content, score}`.
+    BM25 scores are divided by the score of an ideal match of every query term, so they fall into 0~1 like Tavily scores.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        embed: Optional[Embedder] = None,
+        k1: float = 1.2,
+        b: float = 0.75,
+        vector_weight: float = 0.5,
+    ) -> None:
+        self.path = Path(path)
+        self.embed = embed
+        self.k1 = k1
+        self.b = b
+        self.vector_weight = vector_weight
+        self.version = -1
+        self.view = _View()
+        self._manifest_stat: Optional[tuple[int, int, int]] = None
+        self._lock = Lock()
+        self.refresh()
+
+    def _read_manifest(self) -> dict:
+        manifest = self.path / "manifest.json"
+        if not manifest.exists():
+            return {"version": 0, "segments": []}
+        return json.loads(manifest.read_text())
+
+    def _stat_manifest(self) -> Optional[tuple[int, int, int]]:
+        try:
+            stat = (self.path / "manifest.json").stat()
+        except FileNotFoundError:
+            return None
+        # the manifest is replaced by a new file, the inode changes even within the mtime resolution
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def refresh(self) -> None:
+        """Reload the segments if the indexer has written a new manifest, a stat of the manifest when it has not."""
+        stat = self._stat_manifest()
+        if stat == self._manifest_stat:
+            return
+
+        with self._lock:
+            if stat == self._manifest_stat:
+                return
+            manifest = self._read_manifest()
+            if manifest["version"] == self.version:
+                self._manifest_stat = stat
+                return
+            segments = [Segment(self.path / name) for name in manifest["segments"]]
+
+            # newer segments shadow the documents of the same URL in older segments
+            deleted: list[set[int]] = [set() for _ in segments]
+            latest: dict[str, tuple[int, int]] = {}
+            for seg_idx, segment in enumerate(segments):
+                for doc_id, doc in segment.docs():
+                    if doc["url"] in latest:
+                        old_seg, old_doc = latest[doc["url"]]
+                        deleted[old_seg].add(old_doc)
+                    latest[doc["url"]] = (seg_idx, doc_id)
+
+            num_docs = sum(s.num_docs for s in segments)
+            total_len = sum(s.meta["total_len"] for s in segments)
+            # swap the whole view at once, searches running on other threads keep the previous one
+            self.view = _View(
+                segments=segments,
+                deleted=deleted,
+                hashes={segments[s].doc(d)["hash"] for s, d in latest.values()},
+                num_docs=num_docs,
+                avgdl=total_len / num_docs if num_docs else 0.0,
+            )
+            self.version = manifest["version"]
+            self._manifest_stat = stat
+
+    def _bm25(self, view: _View, query: str) -> dict[tuple[int, int], float]:
+        terms = set(tokenize(query))
+        scores: dict[tuple[int, int], float] = {}
+        ideal = 0.0
+        for term in terms:
+            df = sum(s.lexicon.get(term, (0, 0))[1] for s in view.segments)
+            if df == 0:
+                continue
+            idf = math.log(1 + (view.num_docs - df + 0.5) / (df + 0.5))
+            ideal += idf * (self.k1 + 1)
+            for seg_idx, segment in enumerate(view.segments):
+                postings = segment.postings_of(term)
+                deleted = view.deleted[seg_idx]
+                for i in range(0, len(postings), 2):
+                    doc_id, tf = postings[i], postings[i + 1]
+                    if doc_id in deleted:
+                        continue
+                    norm = self.k1 * (1 - self.b + self.b *
+                                      segment.doclens[doc_id] / view.avgdl)
+                    key = (seg_idx, doc_id)
+                    scores[key] = scores.get(key, 0.0) + \
+                        idf * tf * (self.k1 + 1) / (tf + norm)
+        return {key: score / ideal for key, score in scores.items()} if ideal else {}
+
+    def _vector(self, view: _View, query: str) -> dict[tuple[int, int], float]:
+        if not self.embed or not any(s.meta.get("dim") for s in view.segments):
+            return {}
+        import numpy as np
+
+        query_vector = np.asarray(self.embed([query])[0], dtype=np.float32)
+        query_vector /= np.linalg.norm(query_vector) or 1.0
+        scores = {}
+        for seg_idx, segment in enumerate(view.segments):
+            vectors = segment.vectors()
+            if vectors is None or vectors.shape[1] != query_vector.shape[0]:
+                continue
+            for doc_id, score in enumerate(vectors @ query_vector):
+                if doc_id not in view.deleted[seg_idx]:
+                    scores[(seg_idx, doc_id)] = max(0.0, float(score))
+        return scores
+
+    def search(self, query: str, max_results: int = 5) -> list[dict]:
+        self.refresh()
+        view = self.view
+        if not view.segments:
+            return []
+
+        scores = self._bm25(view, query)
+        vector_scores = self._vector(view, query)
+        if vector_scores:
+            w = self.vector_weight
+            scores = {
+                key: (1 - w) * scores.get(key, 0.0) + w * vector_scores.get(key, 0.0)
+                for key in scores.keys() | vector_scores.keys()
+            }
+
+        results = []
+        for (seg_idx, doc_id), score in heapq.nlargest(
+                max_results, scores.items(), key=lambda item: item[1]):
+            doc = view.segments[seg_idx].doc(doc_id)
+            results.append({
+                "title": doc["title"],
+                "url": doc["url"],
+                "content": doc["content"],
+                "score": round(score, 4),
+            })
+        return results
+
+    def add(self, docs: list[dict], embed: Optional[Embedder] = None) -> int:
+        """Index the new or changed documents as a new segment and return the number of indexed documents."""
+        self.refresh()
+        fresh = {}
+        for doc in docs:
+            doc = {**doc, "hash": document_hash(doc)}
+            if doc["hash"] not in self.view.hashes:
+                fresh[doc["url"]] = doc
+        if not fresh:
+            return 0
+
+        manifest = self._read_manifest()
+        name = f"seg-{manifest['version'] + 1:06d}"
+        write_segment(self.path / name, list(fresh.values()), embed)
+        self._write_manifest(manifest["version"] + 1, manifest["segments"] + [name])
+        self.refresh()
+        return len(fresh)
+
+    def compact(self, embed: Optional[Embedder] = None) -> int:
+        """
+        Merge the live documents of every segment into a single segment.
+
+        The documents are embedded again with `embed`, otherwise their stored embeddings are copied.
+        Without `embed`, an index whose segments do not all have embeddings of the same size cannot be compacted,
+        since the documents without one would drop out of the vector search.
+        """
+        self.refresh()
+        view = self.view
+        live = [
+            (segment, doc_id, doc)
+            for seg_idx, segment in enumerate(view.segments)
+            for doc_id, doc in segment.docs()
+            if doc_id not in view.deleted[seg_idx]
+        ]
+        docs = [doc for _, _, doc in live]
+        vectors = None
+        if not embed:
+            dims = {segment.meta.get("dim", 0) for segment, _, _ in live}
+            if len(dims) > 1:
+                raise ValueError(
+                    f"Segments have embeddings of sizes {sorted(dims)} (0 for none), "
+                    "compact with an embedding model to embed every document again")
+            if dims and dims != {0}:
+                vectors = [segment.vector(doc_id) for segment, doc_id, _ in live]
+        manifest = self._read_manifest()
+        name = f"seg-{manifest['version'] + 1:06d}"
+        write_segment(self.path / name, docs, embed, vectors)
+        self._write_manifest(manifest["version"] + 1, [name])
+        self.refresh()
+        for old in manifest["segments"]:
+            shutil.rmtree(self.path / old, ignore_errors=True)
+        return len(docs)
+
+    def _write_manifest(self, version: int, segments: list[str]) -> None:
+        self.path.mkdir(parents=True, exist_ok=True)
+        tmp = self.path / "manifest.json.tmp"
+        tmp.write_text(json.dumps({"version": version, "segments": segments}))
+        # atomic swap, readers never see a partial manifest
+        tmp.replace(self.path / "manifest.json")
@@ -1,15 +1,205 @@
+import os
+import json
+import queue
+import atexit
+import random
 import logging
-from logging.handlers import RotatingFileHandler
+import numbers
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from pathlib import Path
-from typing import Optional
+from threading import Lock
+from typing import Any, Optional
 
 from rich.logging import RichHandler
 
+# "sync" writes records on the caller's thread,
+# "async" only enqueues them and formats/writes on a background listener thread.
+LOG_MODE = os.environ.get("LOG_MODE", "sync").lower()
+# "text" or "json"
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "text").lower()
+# large payloads (plans, search results) are truncated to this size
+LOG_MAX_MESSAGE_CHARS = int(os.environ.get("LOG_MAX_MESSAGE_CHARS", 4096))
+
+
+def _parse_sample_rates(value: str) -> dict[str, float]:
+    """Parse per-logger sample rates, e.g. `task_solver=0.1,web_search_tool=0.5`."""
+    rates = {}
+    for item in value.split(","):
+        if "=" not in item:
+            continue
+        name, rate = item.split("=", 1)
+        rates[name.strip()] = float(rate)
+    return rates
+
+
+LOG_SAMPLE_RATES = _parse_sample_rates(os.environ.get("LOG_SAMPLE_RATES", ""))
+
+
+def _truncate(message: str, max_chars: int) -> str:
+    if max_chars <= 0 or len(message) <= max_chars:
+        return message
+    return f"{message[:max_chars]}... [truncated {len(message) - max_chars} chars]"
+
+
+class _CappedArg:
+    """Renders the arg with its own `%s` or `%r` conversion, truncated to `max_chars`."""
+
+    __slots__ = ("arg", "max_chars")
+
+    def __init__(self, arg: Any, max_chars: int) -> None:
+        self.arg = arg
+        self.max_chars = max_chars
+
+    def __str__(self) -> str:
+        return _truncate(str(self.arg), self.max_chars)
+
+    def __repr__(self) -> str:
+        return _truncate(repr(self.arg), self.max_chars)
+
+
+def _capped_arg(arg: Any, max_chars: int) -> Any:
+    if isinstance(arg, (str, numbers.Number)):
+        # numbers are kept as is for `%d`, `%.2f`, ..., strings are cut with the message
+        return arg
+    return _CappedArg(arg, max_chars)
+
+
+def render_capped(record: logging.LogRecord, max_chars: int = LOG_MAX_MESSAGE_CHARS) -> None:
+    """
+    Merge the args of the record into its message, each object arg truncated to `max_chars`.
+
+    The message shows the args as they are now, not as they are when a handler gets to the record.
+    An arg is still rendered in full by its `str` or `repr` before it is truncated, so the cost of logging
+    a large object is not bounded, only the size of the message is.
+    """
+    if not record.args or max_chars <= 0:
+        return
+    if isinstance(record.args, dict):
+        record.args = {k: _capped_arg(v, max_chars) for k, v in record.args.items()}
+    else:
+        record.args = tuple(_capped_arg(arg, max_chars) for arg in record.args)
+    # the formatter truncates the whole message
+    record.msg = record.getMessage()
+    record.args = None
+
+
+class CappedFormatter(logging.Formatter):
+    """Text formatter which truncates the message to `max_chars`."""
+
+    def __init__(self, *args, max_chars: int = LOG_MAX_MESSAGE_CHARS, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.max_chars = max_chars
+
+    def format(self, record: logging.LogRecord) -> str:
+        render_capped(record, self.max_chars)
+        return super().format(record)
+
+    def formatMessage(self, record: logging.LogRecord) -> str:
+        record.message = _truncate(record.message, self.max_chars)
+        return super().formatMessage(record)
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats a record as a single JSON line, truncating the message to `max_chars`."""
+
+    def __init__(self, max_chars: int = LOG_MAX_MESSAGE_CHARS) -> None:
+        super().__init__(datefmt="%Y-%m-%dT%H:%M:%S%z")
+        self.max_chars = max_chars
+
+    def format(self, record: logging.LogRecord) -> str:
+        render_capped(record, self.max_chars)
+        payload = {
+            "time": self.formatTime(record, self.datefmt),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": _truncate(record.getMessage(), self.max_chars),
+            "thread": record.threadName,
+        }
+        if record.exc_info:
+            payload["exception"] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps only `rate` fraction of records below WARNING, warnings and errors are always kept."""
+
+    def __init__(self, rate: float) -> None:
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno >= logging.WARNING or random.random() < self.rate
+
+
+class _DeferredQueueHandler(QueueHandler):
+    """
+    QueueHandler which leaves the formatting of the record to the listener thread.
+
+    The args are merged into the message on the caller's thread with `render_capped`,
+    so the listener does not render objects which the caller mutates meanwhile.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        render_capped(record)
+        return record
+
+
+class _DispatchHandler(logging.Handler):
+    """Routes records from the shared queue to the handlers of the logger which emitted them."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.routes: dict[str, list[logging.Handler]] = {}
+
+    def add_route(self, name: str, handler: logging.Handler) -> None:
+        self.routes.setdefault(name, []).append(handler)
+
+    def handle(self, record: logging.LogRecord) -> bool:
+        for handler in self.routes.get(record.name, []):
+            if record.levelno >= handler.level:
+                handler.handle(record)
+        return True
+
+
+_queue: queue.SimpleQueue = queue.SimpleQueue()
+_dispatcher = _DispatchHandler()
+_listener: Optional[QueueListener] = None
+_listener_lock = Lock()
+
+
+def _start_listener() -> None:
+    global _listener
+    with _listener_lock:
+        if _listener:
+            return
+        _listener = QueueListener(_queue, _dispatcher, respect_handler_level=False)
+        _listener.start()
+        atexit.register(stop_logging)
+
+
+def stop_logging() -> None:
+    """Flush the pending records of the async mode and stop the listener thread."""
+    global _listener
+    with _listener_lock:
+        if _listener:
+            _listener.stop()
+            _listener = None
+
+
+def _build_formatter() -> logging.Formatter:
+    if LOG_FORMAT == "json":
+        return JsonFormatter()
+    return CappedFormatter(
+        "%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+    )
+
 
 def get_logger(
     name: str,
     level: int = logging.INFO,
     log_filename: Optional[str] = None,
+    sample_rate: Optional[float] = None,
 ) -> logging.Logger:
     logger = logging.getLogger(name)
     if logger.handlers:
@@ -17,14 +207,16 @@ def get_logger(
 
     logger.setLevel(level)
 
-    console_handler = RichHandler(level=level)
+    formatter = _build_formatter()
+    handlers: list[logging.Handler] = []
 
-    formatter = logging.Formatter(
-        "%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-        datefmt="%Y-%m-%d %H:%M:%S",
-    )
+    if LOG_FORMAT == "json":
+        console_handler: logging.Handler = logging.StreamHandler()
+    else:
+        console_handler = RichHandler(level=level)
+    console_handler.setLevel(level)
     console_handler.setFormatter(formatter)
-    logger.addHandler(console_handler)
+    handlers.append(console_handler)
 
     if log_filename:
         log_path = Path(log_filename).parent
@@ -38,7 +230,22 @@ def get_logger(
         )
         file_handler.setLevel(level)
         file_handler.setFormatter(formatter)
-        logger.addHandler(file_handler)
+        handlers.append(file_handler)
+
+    if LOG_MODE == "async":
+        for handler in handlers:
+            _dispatcher.add_route(name, handler)
+        logger.addHandler(_DeferredQueueHandler(_queue))
+        _start_listener()
+    else:
+        for handler in handlers:
+            logger.addHandler(handler)
+
+    sample_rate = LOG_SAMPLE_RATES.get(name, sample_rate)
+    if sample_rate is not None and sample_rate < 1.0:
+        logger.addFilter(SamplingFilter(sample_rate))
+
+    if log_filename:
         logger.info(f"[{name}] Logging at {log_filename}...")
 
     return logger
@@ -0,0 +1,61 @@
+"""
+Aggregates the stats snapshots of the app, served by the `/metrics` route of the app.
+
+Only the modules which are already imported are collected, so scraping never pulls in a heavy dependency.
+"""
+
+import sys
+from typing import Any, Callable
+
+# name -> (module, snapshot getter)
+SOURCES: dict[str, tuple[str, Callable[[Any], dict]]] = {
+    "admission": ("src.admission", lambda m: m.admission.snapshot()),
+    "cancellation": ("src.cancellation", lambda m: m.cancel_stats.snapshot()),
+    "degradation": ("src.workflow.deadline", lambda m: m.degradation_stats.snapshot()),
+    "stream": ("src.stream_buffer", lambda m: m.stream_stats.snapshot()),
+    "search_budget": ("src.workflow.tool.search_budget", lambda m: m.controller.snapshot()),
+    "search_cache": ("src.workflow.tool.web_search", lambda m: m.search_cache.snapshot()),
+    "rerank_cache": ("src.reranker", lambda m: m.rerank_cache.snapshot()),
+    "rate_limit": ("src.upstream", lambda m: m.rate_limit_stats.snapshot()),
+    "llm_cache": ("src.llm_cache", lambda m: m.llm_cache_stats.snapshot()),
+    "llm_nodes": ("src.llm_tiering", lambda m: m.node_stats.snapshot()),
+}
+
+PREFIX = "open_perplexity"
+
+
+def collect(**extra: dict) -> dict[str, dict]:
+    """Snapshots of every loaded source, `extra` adds the snapshots which are owned by the app."""
+    snapshots = {}
+    for name, (module, snapshot) in SOURCES.items():
+        if module in sys.modules:
+            snapshots[name] = snapshot(sys.modules[module])
+    snapshots.update(extra)
+    return snapshots
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _samples(name: str, value: Any, labels: tuple[str, ...]):
+    if isinstance(value, bool):
+        yield name, labels, int(value)
+    elif isinstance(value, (int, float)):
+        yield name, labels, value
+    elif isinstance(value, dict):
+        # counters keyed by reason, stage, task type, ... become labels
+        for key, nested in value.items():
+            yield from _samples(name, nested, labels + (str(key),))
+
+
+def to_prometheus(snapshots: dict[str, dict]) -> str:
+    """Render the snapshots in the Prometheus text format, nested keys are exposed as `key`, `key2`, ... labels."""
+    lines = []
+    for source, snapshot in snapshots.items():
+        for field, value in snapshot.items():
+            for name, labels, number in _samples(f"{PREFIX}_{source}_{field}", value, ()):
+                label_text = ",".join(
+                    f'key{i + 1 if i else ""}="{_escape(label)}"' for i, label in enumerate(labels))
+                lines.append(f"{name}{{{label_text}}} {number}" if labels else f"{name} {number}")
+    return "\n".join(lines) + "\n"
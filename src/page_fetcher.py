@@ -0,0 +1,202 @@
+"""
+Fetch the top-ranked source pages and extract their main text, so the summarizer sees more than the search snippets.
+"""
+
+import os
+import codecs
+import asyncio
+from functools import cache
+from html.parser import HTMLParser
+from typing import Optional
+from urllib.parse import urlparse
+
+import httpx
+
+from . import upstream
+from .cache import TTLCache
+from .logger import get_logger
+
+logger = get_logger("page_fetcher")
+
+PAGE_FETCH_ENABLED = os.environ.get(
+    "PAGE_FETCH_ENABLED", "false").lower() == "true"
+PAGE_FETCH_TOP_K = int(os.environ.get("PAGE_FETCH_TOP_K", 3))
+# hard timeout per page in seconds, including the time waiting for the per-host slot
+PAGE_FETCH_TIMEOUT = float(os.environ.get("PAGE_FETCH_TIMEOUT", 3.0))
+PAGE_FETCH_MAX_BYTES = int(os.environ.get("PAGE_FETCH_MAX_BYTES", 512 * 1024))
+PAGE_FETCH_PER_HOST = int(os.environ.get("PAGE_FETCH_PER_HOST", 2))
+# maximum characters of the extracted text added to a source
+PAGE_FETCH_MAX_CHARS = int(os.environ.get("PAGE_FETCH_MAX_CHARS", 4000))
+PAGE_FETCH_CACHE_TTL = float(os.environ.get("PAGE_FETCH_CACHE_TTL", 3600))
+
+SKIP_TAGS = {"script", "style", "noscript", "nav", "header", "footer",
+             "aside", "form", "svg", "iframe", "template", "button"}
+BLOCK_TAGS = {"p", "li", "h1", "h2", "h3", "h4", "h5", "h6", "blockquote",
+              "pre", "td", "th", "dd", "dt", "article", "section", "div", "br", "tr"}
+MIN_PASSAGE_CHARS = 40
+
+
+class TextExtractor(HTMLParser):
+    """
+    Incremental HTML parser which collects the text of block elements as passages,
+    skipping scripts, styles and page chrome like navigation, header and footer.
+    """
+
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=True)
+        self.passages: list[str] = []
+        self._buffer: list[str] = []
+        self._skip_depth = 0
+
+    def _flush(self) -> None:
+        text = " ".join("".join(self._buffer).split())
+        self._buffer = []
+        if len(text) >= MIN_PASSAGE_CHARS:
+            self.passages.append(text)
+
+    def handle_starttag(self, tag: str, attrs: list) -> None:
+        if tag in SKIP_TAGS:
+            self._skip_depth += 1
+        elif tag in BLOCK_TAGS:
+            self._flush()
+
+    def handle_endtag(self, tag: str) -> None:
+        if tag in SKIP_TAGS:
+            self._skip_depth = max(0, self._skip_depth - 1)
+        elif tag in BLOCK_TAGS:
+            self._flush()
+
+    def handle_data(self, data: str) -> None:
+        if not self._skip_depth:
+            self._buffer.append(data)
+
+    def close(self) -> None:
+        super().close()
+        self._flush()
+
+
+class PageFetcher:
+    """
+    PageFetcher fetches pages in parallel over a shared HTTP connection pool.
+
+    - per-host concurrency limits, so a single site is not hammered by a request
+    - size caps, the body is streamed to the parser and the download stops at `max_bytes`
+    - hard timeouts, a slow page is dropped and the source keeps its search snippet
+    - extracted passages are cached by URL, and revalidated with the ETag once expired
+    """
+
+    def __init__(
+        self,
+        timeout: float = PAGE_FETCH_TIMEOUT,
+        max_bytes: int = PAGE_FETCH_MAX_BYTES,
+        per_host: int = PAGE_FETCH_PER_HOST,
+        max_chars: int = PAGE_FETCH_MAX_CHARS,
+        cache_ttl: float = PAGE_FETCH_CACHE_TTL,
+        client: Optional[httpx.AsyncClient] = None,
+    ) -> None:
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self.per_host = per_host
+        self.max_chars = max_chars
+        self.client = client or httpx.AsyncClient(
+            follow_redirects=True,
+            headers={"User-Agent": "open-perplexity/0.1"},
+            limits=httpx.Limits(max_connections=64, max_keepalive_connections=16),
+        )
+        # fresh passages by URL
+        self.cache: TTLCache[str, list[str]] = TTLCache(maxsize=2048, ttl=cache_ttl)
+        # (ETag, passages) by URL, kept longer to revalidate expired pages
+        self.etags: TTLCache[str, tuple[str, list[str]]] = TTLCache(maxsize=2048)
+        self._host_limits: dict[str, asyncio.Semaphore] = {}
+
+    def _host_limit(self, url: str) -> asyncio.Semaphore:
+        host = urlparse(url).netloc
+        if host not in self._host_limits:
+            self._host_limits[host] = asyncio.Semaphore(self.per_host)
+        return self._host_limits[host]
+
+    async def _download(self, url: str) -> list[str]:
+        headers = {}
+        validated = self.etags.get(url)
+        if validated:
+            headers["If-None-Match"] = validated[0]
+
+        async with self.client.stream("GET", url, headers=headers) as response:
+            if response.status_code == 304 and validated:
+                return validated[1]
+            content_type = response.headers.get("content-type", "")
+            if response.status_code != 200 or "html" not in content_type:
+                return []
+
+            parser = TextExtractor()
+            decoder = codecs.getincrementaldecoder(
+                response.encoding or "utf-8")(errors="replace")
+            received = 0
+            async for chunk in response.aiter_bytes():
+                received += len(chunk)
+                parser.feed(decoder.decode(chunk))
+                if received >= self.max_bytes:
+                    break
+            parser.feed(decoder.decode(b"", final=True))
+            parser.close()
+
+            etag = response.headers.get("etag")
+            if etag:
+                self.etags.set(url, (etag, parser.passages))
+            return parser.passages
+
+    async def fetch(self, url: str) -> list[str]:
+        """Return the main-text passages of the page, empty if it could not be fetched in time."""
+        # not cached while a workload is recorded or replayed, every fetch must be in the recording
+        use_cache = upstream.caches_enabled()
+        cached = self.cache.get(url) if use_cache else None
+        if cached is not None:
+            return cached
+        try:
+            async with asyncio.timeout(self.timeout):
+                async with self._host_limit(url):
+                    passages = await upstream.acall(
+                        "http", "page_fetcher",
+                        lambda: self._download(url),
+                        key=url,
+                    )
+        except TimeoutError:
+            logger.warning("Fetching %s timed out", url)
+            return []
+        except (httpx.HTTPError, UnicodeError, LookupError) as e:
+            logger.warning("Fetching %s failed: %s", url, e)
+            return []
+        if use_cache:
+            self.cache.set(url, passages)
+        return passages
+
+    def _merge(self, source: dict, passages: list[str]) -> dict:
+        text = []
+        size = 0
+        for passage in passages:
+            if size + len(passage) > self.max_chars:
+                break
+            text.append(passage)
+            size += len(passage)
+        if not text:
+            return source
+        return {**source, "content": f"{source['content']}\n\n" + "\n".join(text)}
+
+    async def enrich(self, sources: list[dict], top_k: int = PAGE_FETCH_TOP_K) -> list[dict]:
+        """Add the extracted text of the top-k sources to their content, the rest are kept as they are."""
+        top = sources[:top_k]
+        fetched = await asyncio.gather(*[self.fetch(s["url"]) for s in top])
+        return [self._merge(s, p) for s, p in zip(top, fetched)] + sources[top_k:]
+
+
+@cache
+def get_page_fetcher() -> PageFetcher:
+    """Share the fetcher and its connection pool across sessions."""
+    return PageFetcher()
+
+
+async def fetch_pages(sources: list[dict]) -> list[dict]:
+    """Enrich the ranked sources with the text of their pages if `PAGE_FETCH_ENABLED` is set."""
+    if not PAGE_FETCH_ENABLED or not sources:
+        return sources
+    return await get_page_fetcher().enrich(sources)
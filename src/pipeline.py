@@ -0,0 +1,106 @@
+"""
+The research pipeline without the UI: `ResearchFlow`, then rerank and page fetch, then the answer.
+
+Mirror of `app.process_message`, shared by the workload replayer and the batch runner.
+"""
+
+from time import perf_counter
+from typing import Any, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import BaseMessage, HumanMessage
+
+from .llm_tiering import NodeModels
+from .reranker import rank_by_score, rerank
+from .page_fetcher import fetch_pages
+from .workflow.deadline import Deadline
+from .workflow.graph import ResearchFlow
+from .workflow.node.quick_responder import QuickResponder
+from .workflow.node.task_summarizer import TaskSummarizer
+
+
+class AnswerCollector:
+    """Collects streamed tokens in place of `cl.Message`."""
+
+    def __init__(self) -> None:
+        self.content = ""
+
+    async def stream_token(self, token: str) -> None:
+        self.content += token
+
+
+class ResearchPipeline:
+    """Compiles the graph and creates the responders once, runs can share them concurrently."""
+
+    def __init__(
+        self,
+        model: BaseChatModel | NodeModels,
+        aws_profile_name: Optional[str] = None,
+        aws_region: Optional[str] = None,
+        k: int = 5,
+    ) -> None:
+        models = model if isinstance(model, NodeModels) else NodeModels(model)
+        self.state_graph = ResearchFlow(models).state_graph.compile()
+        self.task_summarizer = TaskSummarizer(models["task_summarizer"])
+        self.quick_responder = QuickResponder(models["quick_responder"])
+        self.aws_profile_name = aws_profile_name
+        self.aws_region = aws_region
+        self.k = k
+
+    async def run(
+        self,
+        user_input: str,
+        messages: Optional[list[BaseMessage]] = None,
+        deadline: Optional[Deadline] = None,
+    ) -> dict[str, Any]:
+        """
+        Answer the user input, returns the answer with the final state and the seconds spent in each stage.
+
+        `messages` is the conversation history before the user input.
+        """
+        timings: dict[str, float] = {}
+        try:
+            started = perf_counter()
+            state = await self.state_graph.ainvoke(
+                {
+                    "user_input": user_input,
+                    "messages": [*(messages or []), HumanMessage(content=user_input)],
+                    "deadline": deadline,
+                },
+            )
+            timings["graph"] = perf_counter() - started
+            plan = state.get("plan")
+
+            collector = AnswerCollector()
+            if plan and plan.tasks:
+                started = perf_counter()
+                if deadline and deadline.below(0.2):
+                    deadline.degrade("skip_rerank", f"{len(state['sources'])} sources")
+                    state["sources"] = rank_by_score(state["sources"], k=self.k)
+                else:
+                    state["sources"] = await rerank(
+                        state["user_input"],
+                        state["sources"],
+                        aws_profile_name=self.aws_profile_name,
+                        aws_region=self.aws_region,
+                        k=self.k,
+                    )
+                    state["sources"] = await fetch_pages(state["sources"])
+                timings["rerank"] = perf_counter() - started
+                started = perf_counter()
+                await self.task_summarizer(collector, state)
+                timings["answer"] = perf_counter() - started
+            elif plan:
+                started = perf_counter()
+                await self.quick_responder(collector, state)
+                timings["answer"] = perf_counter() - started
+        finally:
+            # failed runs are accounted as well
+            if deadline:
+                deadline.finish()
+
+        return {
+            "answer": collector.content,
+            "state": state,
+            "timings": {stage: round(t, 4) for stage, t in timings.items()},
+        }
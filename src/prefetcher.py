@@ -0,0 +1,181 @@
+"""
+Predictive prefetch of follow-up searches during user think time.
+
+After an answer is sent, the last plan and sources are used to guess the queries of a likely follow-up question,
+and the search cache is warmed with them in the background, only while the process is not busy.
+The results per query follow the search budget controller, so the prefetched entries are under the keys the next search looks up.
+
+The rerank cache is not warmed: its key is the revised user input with the sources of every task,
+which a prefetch of single queries cannot predict. The app prefetches when `PREFETCH_ENABLED` is set.
+"""
+
+import os
+import time
+import asyncio
+import contextvars
+from threading import Lock
+from collections import deque
+from typing import Callable, Optional
+
+from .logger import get_logger
+from .workflow.state import Plan
+from .workflow.tool.web_search import prefetch_search, search_cache
+from .workflow.tool.search_budget import controller
+
+logger = get_logger("prefetcher")
+
+# queries guessed after each answer
+PREFETCH_MAX_QUERIES = int(os.environ.get("PREFETCH_MAX_QUERIES", 3))
+# queries prefetched per session within the window
+PREFETCH_SESSION_BUDGET = int(os.environ.get("PREFETCH_SESSION_BUDGET", 10))
+PREFETCH_SESSION_WINDOW = float(os.environ.get("PREFETCH_SESSION_WINDOW", 3600))
+# queries prefetched per minute across every session
+PREFETCH_GLOBAL_BUDGET = int(os.environ.get("PREFETCH_GLOBAL_BUDGET", 30))
+# seconds to wait for the process to become idle before dropping a prefetch
+PREFETCH_IDLE_WAIT = float(os.environ.get("PREFETCH_IDLE_WAIT", 10))
+
+
+class _SlidingBudget:
+    """Allows at most `limit` events within the last `window` seconds."""
+
+    def __init__(self, limit: int, window: float) -> None:
+        self.limit = limit
+        self.window = window
+        self._events: deque[float] = deque()
+
+    def try_acquire(self) -> bool:
+        now = time.monotonic()
+        while self._events and self._events[0] <= now - self.window:
+            self._events.popleft()
+        if len(self._events) >= self.limit:
+            return False
+        self._events.append(now)
+        return True
+
+
+class Prefetcher:
+    def __init__(
+        self,
+        is_busy: Callable[[], bool] = lambda: False,
+        max_queries: int = PREFETCH_MAX_QUERIES,
+        session_budget: int = PREFETCH_SESSION_BUDGET,
+        session_window: float = PREFETCH_SESSION_WINDOW,
+        global_budget: int = PREFETCH_GLOBAL_BUDGET,
+    ) -> None:
+        self.is_busy = is_busy
+        self.max_queries = max_queries
+        self.session_budget = session_budget
+        self.session_window = session_window
+        self._global_budget = _SlidingBudget(global_budget, 60)
+        self._session_budgets: dict[str, _SlidingBudget] = {}
+        self._tasks: dict[str, asyncio.Task] = {}
+        # prefetches run one at a time, they should never compete with user requests
+        self._semaphore = asyncio.Semaphore(1)
+        self._lock = Lock()
+        self.counters = {
+            "scheduled": 0,
+            "queries_predicted": 0,
+            "queries_sent": 0,
+            "skipped_session_budget": 0,
+            "skipped_global_budget": 0,
+            "skipped_busy": 0,
+            "errors": 0,
+        }
+
+    def _count(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self.counters[name] += n
+
+    def predict(self, plan: Plan, sources: list[dict], max_results: int) -> list[str]:
+        """Guess the queries of a follow-up question from the last plan and the cited sources."""
+        candidates = [source["title"] for source in sources[:2] if source.get("title")]
+        candidates += [f"{task.title} details" for task in plan.tasks]
+        candidates.append(plan.revised_user_input)
+
+        queries = []
+        for query in dict.fromkeys(q.strip() for q in candidates if q and q.strip()):
+            if len(queries) >= self.max_queries:
+                break
+            if (query, max_results) not in search_cache:
+                queries.append(query)
+        return queries
+
+    def schedule(self, session_id: str, plan: Plan, sources: list[dict], category: Optional[str] = None) -> None:
+        """
+        Start prefetching in the background, replacing the pending prefetch of the session.
+
+        `category` is the category of the router, which the search budget controller adapts the results per query to.
+        """
+        max_results = controller.max_results_for(category or "default")
+        queries = self.predict(plan, sources, max_results)
+        if not queries:
+            return
+        self.cancel(session_id)
+        self._count("scheduled")
+        self._count("queries_predicted", len(queries))
+        # run outside of the request context, the request scope and recording must not apply to the prefetch
+        self._tasks[session_id] = asyncio.create_task(
+            self._run(session_id, queries, max_results), context=contextvars.Context())
+
+    def cancel(self, session_id: str) -> None:
+        task = self._tasks.pop(session_id, None)
+        if task and not task.done():
+            task.cancel()
+
+    def close_session(self, session_id: str) -> None:
+        self.cancel(session_id)
+        self._session_budgets.pop(session_id, None)
+
+    async def _wait_idle(self) -> bool:
+        waited = 0.0
+        while self.is_busy():
+            if waited >= PREFETCH_IDLE_WAIT:
+                return False
+            await asyncio.sleep(0.5)
+            waited += 0.5
+        return True
+
+    def _acquire_budget(self, session_id: str) -> bool:
+        session_budget = self._session_budgets.setdefault(
+            session_id, _SlidingBudget(self.session_budget, self.session_window))
+        if not session_budget.try_acquire():
+            self._count("skipped_session_budget")
+            return False
+        if not self._global_budget.try_acquire():
+            self._count("skipped_global_budget")
+            return False
+        return True
+
+    async def _run(self, session_id: str, queries: list[str], max_results: int) -> None:
+        try:
+            for index, query in enumerate(queries):
+                async with self._semaphore:
+                    if not await self._wait_idle():
+                        self._count("skipped_busy", len(queries) - index)
+                        return
+                    if not self._acquire_budget(session_id):
+                        return
+                    try:
+                        self._count("queries_sent")
+                        await asyncio.to_thread(prefetch_search, query, max_results)
+                    except asyncio.CancelledError:
+                        raise
+                    except Exception as e:
+                        self._count("errors")
+                        logger.warning("Prefetch of %s failed: %s", query, e)
+        finally:
+            # a newer prefetch of the session may have replaced this one already
+            if self._tasks.get(session_id) is asyncio.current_task():
+                del self._tasks[session_id]
+
+    def snapshot(self) -> dict:
+        """Counters with the prefetch accounting of the search cache, hit rate tells whether prefetching pays off."""
+        with self._lock:
+            counters = dict(self.counters)
+        cache = search_cache.snapshot()
+        counters["search_prefetched"] = cache["prefetched"]
+        counters["search_prefetch_hits"] = cache["prefetch_hits"]
+        counters["search_prefetch_wasted"] = cache["prefetch_wasted"]
+        counters["search_hit_rate"] = round(
+            cache["prefetch_hits"] / cache["prefetched"], 3) if cache["prefetched"] else 0.0
+        return counters
@@ -0,0 +1,237 @@
+"""
+Opt-in sampling profiler of requests, to see where the CPU time of our own code goes.
+
+A request is profiled with the probability `PROFILE_SAMPLE_RATE`, or when its session was enabled at runtime (see `/debug/profile` in `app.py`).
+While a profiled request runs a graph node, the thread of the node and the worker threads started by it are sampled,
+and each sample is attributed to the node. The profile is written to `PROFILE_DIR` when the request finishes, as collapsed stacks
+(for flamegraph.pl, speedscope, ...) or in the speedscope format.
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import threading
+from pathlib import Path
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Iterator, Optional, TypeVar
+
+from .logger import get_logger
+
+logger = get_logger("profiler")
+
+T = TypeVar("T")
+
+# fraction of requests to profile
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", 0))
+# seconds between samples
+PROFILE_INTERVAL = float(os.environ.get("PROFILE_INTERVAL", 0.005))
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "data/profiles")
+# "collapsed" or "speedscope"
+PROFILE_FORMAT = os.environ.get("PROFILE_FORMAT", "collapsed").lower()
+# frames deeper than this are dropped, to bound the cost of a sample
+MAX_STACK_DEPTH = 128
+
+
+def _frame_name(code: Any) -> str:
+    return f"{code.co_qualname} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class ProfileSession:
+    """Samples of a single request, by stack from the node down to the innermost frame."""
+
+    def __init__(self, session_id: Optional[str], reason: str) -> None:
+        self.id = uuid.uuid4().hex[:12]
+        self.session_id = session_id
+        self.reason = reason
+        self.started_at = time.time()
+        self.samples: Counter[tuple[str, ...]] = Counter()
+        self._lock = threading.Lock()
+
+    def add(self, stack: tuple[str, ...]) -> None:
+        with self._lock:
+            self.samples[stack] += 1
+
+    def collapsed(self) -> str:
+        with self._lock:
+            return "".join(f"{';'.join(stack)} {count}\n" for stack, count in self.samples.most_common())
+
+    def speedscope(self, interval: float) -> dict:
+        frames: dict[str, int] = {}
+        samples, weights = [], []
+        with self._lock:
+            for stack, count in self.samples.items():
+                samples.append([frames.setdefault(name, len(frames)) for name in stack])
+                weights.append(round(count * interval, 6))
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "shared": {"frames": [{"name": name} for name in frames]},
+            "profiles": [{
+                "type": "sampled",
+                "name": f"request {self.id} ({self.reason})",
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": round(sum(weights), 6),
+                "samples": samples,
+                "weights": weights,
+            }],
+            "name": f"request {self.id}",
+            "exporter": "open-perplexity",
+        }
+
+
+current_profile: ContextVar[Optional[ProfileSession]] = ContextVar(
+    "current_profile", default=None)
+# the node which the current context works for, inherited by worker threads
+current_label: ContextVar[str] = ContextVar("current_label", default="request")
+
+
+class SamplingProfiler:
+    def __init__(
+        self,
+        sample_rate: float = PROFILE_SAMPLE_RATE,
+        interval: float = PROFILE_INTERVAL,
+        output_dir: str = PROFILE_DIR,
+        output_format: str = PROFILE_FORMAT,
+    ) -> None:
+        self.sample_rate = sample_rate
+        self.interval = interval
+        self.output_dir = Path(output_dir)
+        self.output_format = output_format
+        # session id -> number of requests left to profile
+        self.sessions: dict[str, int] = {}
+        self.written: list[str] = []
+        # thread id -> (profile, node) of the threads to sample
+        self._threads: dict[int, tuple[ProfileSession, str]] = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._sampler: Optional[threading.Thread] = None
+
+    def enable_session(self, session_id: str, requests: int = 1) -> None:
+        with self._lock:
+            self.sessions[session_id] = requests
+
+    def disable_session(self, session_id: str) -> None:
+        with self._lock:
+            self.sessions.pop(session_id, None)
+
+    def start(self, session_id: Optional[str] = None) -> Optional[ProfileSession]:
+        """Decide whether to profile the request, returns its profile if so."""
+        with self._lock:
+            if session_id and self.sessions.get(session_id, 0) > 0:
+                self.sessions[session_id] -= 1
+                if not self.sessions[session_id]:
+                    del self.sessions[session_id]
+                reason = "session"
+            elif self.sample_rate > 0 and random.random() < self.sample_rate:
+                reason = "sampled"
+            else:
+                return None
+        return ProfileSession(session_id, reason)
+
+    def finish(self, profile: ProfileSession) -> Optional[str]:
+        """Write the profile, returns the path of the file."""
+        if not profile.samples:
+            return None
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        stamp = time.strftime("%Y%m%dT%H%M%S", time.gmtime(profile.started_at))
+        if self.output_format == "speedscope":
+            path = self.output_dir / f"{stamp}-{profile.id}.speedscope.json"
+            path.write_text(json.dumps(profile.speedscope(self.interval)), encoding="utf-8")
+        else:
+            path = self.output_dir / f"{stamp}-{profile.id}.collapsed.txt"
+            path.write_text(profile.collapsed(), encoding="utf-8")
+        logger.info("Profile of request %s with %d samples written to %s",
+                    profile.id, profile.samples.total(), path)
+        with self._lock:
+            self.written = [*self.written[-99:], str(path)]
+        return str(path)
+
+    @contextmanager
+    def attach(self, label: Optional[str] = None) -> Iterator[None]:
+        """Sample the current thread while it works for the profiled request of the context, if any."""
+        profile = current_profile.get()
+        if profile is None:
+            yield
+            return
+        label = label or current_label.get()
+        tid = threading.get_ident()
+        label_token = current_label.set(label)
+        with self._lock:
+            previous = self._threads.get(tid)
+            self._threads[tid] = (profile, label)
+        self._ensure_sampler()
+        try:
+            yield
+        finally:
+            with self._lock:
+                if previous:
+                    self._threads[tid] = previous
+                else:
+                    self._threads.pop(tid, None)
+            current_label.reset(label_token)
+
+    def attached(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """Call the function under `attach`, for functions submitted to worker threads with a copied context."""
+        with self.attach():
+            return fn(*args, **kwargs)
+
+    def _ensure_sampler(self) -> None:
+        self._wakeup.set()
+        if self._sampler and self._sampler.is_alive():
+            return
+        with self._lock:
+            if self._sampler and self._sampler.is_alive():
+                return
+            self._sampler = threading.Thread(target=self._run, name="profiler", daemon=True)
+            self._sampler.start()
+
+    def _sample(self) -> None:
+        with self._lock:
+            threads = dict(self._threads)
+        frames = sys._current_frames()
+        for tid, (profile, label) in threads.items():
+            frame = frames.get(tid)
+            stack = []
+            while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                stack.append(_frame_name(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                profile.add((label, *reversed(stack)))
+
+    def _run(self) -> None:
+        while True:
+            if not self._threads:
+                # sleep until a profiled request attaches a thread
+                self._wakeup.wait()
+                self._wakeup.clear()
+            self._sample()
+            time.sleep(self.interval)
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                "sample_rate": self.sample_rate,
+                "interval": self.interval,
+                "format": self.output_format,
+                "sessions": dict(self.sessions),
+                "active_threads": len(self._threads),
+                "written": list(self.written[-10:]),
+            }
+
+
+profiler = SamplingProfiler()
+
+
+def profiled(name: str, node: Callable[[Any], T]) -> Callable[[Any], T]:
+    """Attribute the samples of the node to its name while the request is profiled."""
+
+    def run(state: Any) -> T:
+        with profiler.attach(name):
+            return node(state)
+
+    return run
@@ -1,8 +1,21 @@
+import os
 import json
-from typing import Optional
+import asyncio
+import hashlib
+from functools import cache, cached_property
+from typing import Any, Optional
 
 import boto3
 
+from . import upstream
+from .cache import TTLCache
+
+RERANK_CACHE_TTL = float(os.environ.get("RERANK_CACHE_TTL", 600))
+
+# reranked documents by (query, k, hash of the documents)
+rerank_cache: TTLCache[tuple[str, int, str], list[str]] = TTLCache(
+    maxsize=1024, ttl=RERANK_CACHE_TTL)
+
 
 class Reranker:
     def __init__(
@@ -12,8 +25,22 @@ class Reranker:
         aws_region: Optional[str] = None,
     ):
         self.model = model
-        session = boto3.Session(profile_name=aws_profile_name)
-        self.client = session.client("bedrock-runtime", region_name=aws_region)
+        self.aws_profile_name = aws_profile_name
+        self.aws_region = aws_region
+
+    @cached_property
+    def client(self) -> Any:
+        """Created on the first upstream call, so replaying a workload needs no AWS configuration."""
+        session = boto3.Session(profile_name=self.aws_profile_name)
+        return session.client("bedrock-runtime", region_name=self.aws_region)
+
+    def _invoke(self, request_body: dict) -> list[dict]:
+        response = self.client.invoke_model(
+            modelId=self.model,
+            body=json.dumps(request_body),
+            contentType="application/json",
+        )
+        return json.loads(response["body"].read())["results"]
 
     async def rerank(self, docs: list[str], query: str, k: int = 5) -> list[str]:
         if not docs:
@@ -28,12 +55,73 @@ class Reranker:
         if "cohere" in self.model:
             request_body["api_version"] = 2
 
-        response = self.client.invoke_model(
-            modelId=self.model,
-            body=json.dumps(request_body),
-            contentType="application/json",
+        # boto3 is blocking, keep the event loop free for other sessions
+        results = await asyncio.to_thread(
+            upstream.call,
+            "rerank", "reranker",
+            lambda: self._invoke(request_body),
+            key=query,
         )
-        results = json.loads(response["body"].read())["results"]
         # ignore the order of the result because it is too small number
         indices = [r["index"] for r in results]
         return [s for i, s in enumerate(docs) if i in indices]
+
+
+@cache
+def get_reranker(aws_profile_name: Optional[str] = None, aws_region: Optional[str] = None) -> Reranker:
+    """Share a reranker (and its boto3 client) per profile and region instead of creating one per request."""
+    return Reranker(aws_profile_name=aws_profile_name, aws_region=aws_region)
+
+
+def _deduplicate_source(sources: list[dict]) -> list[str]:
+    """
+    We are going to use rerank with JSON string input, because url data should be stick to the content in order.
+
+    1. deduplicate sources based on the URL
+    2. leave title, url and content field only
+    3. stringify each content
+    """
+    D = {source["url"]: source for source in sources}
+    return [
+        json.dumps(
+            {"title": source["title"], "url": source["url"], "content": source["content"]})
+        for source in D.values()
+    ]
+
+
+def rank_by_score(sources: list[dict], k: int = 5) -> list[dict]:
+    """Deduplicate the sources and keep the top-k by search score, the cheap alternative of `rerank`."""
+    D: dict[str, dict] = {}
+    for source in sources:
+        if source["url"] not in D or source.get("score", 0) > D[source["url"]].get("score", 0):
+            D[source["url"]] = source
+    ranked = sorted(D.values(), key=lambda s: s.get("score", 0), reverse=True)
+    return [
+        {"title": source["title"], "url": source["url"], "content": source["content"]}
+        for source in ranked[:k]
+    ]
+
+
+async def rerank(
+    user_input: str,
+    sources: list[dict],
+    aws_profile_name: Optional[str] = None,
+    aws_region: Optional[str] = None,
+    k: int = 5,
+) -> list[dict]:
+    """Deduplicate the sources and keep the top-k relevant ones to the user input."""
+    docs = _deduplicate_source(sources)
+    key = (user_input, k, hashlib.sha1("\n".join(docs).encode("utf-8")).hexdigest())
+    # not cached while a workload is recorded or replayed, every rerank call must be in the recording
+    use_cache = upstream.caches_enabled()
+    new_sources = rerank_cache.get(key) if use_cache else None
+    if new_sources is None:
+        reranker = get_reranker(aws_profile_name, aws_region)
+        new_sources = await reranker.rerank(
+            query=user_input,
+            docs=docs,
+            k=k,
+        )
+        if use_cache:
+            rerank_cache.set(key, new_sources)
+    return [json.loads(ns) for ns in new_sources]
@@ -0,0 +1,112 @@
+"""
+Startup profiler for the app entry point.
+
+It imports the target module in a fresh interpreter with `-X importtime`,
+reports the import time per top-level module and fails when the cold start exceeds the budget.
+
+    uv run -- python -m src.startup --module app --budget 3.0
+"""
+
+import os
+import sys
+import time
+import argparse
+import subprocess
+from dataclasses import dataclass
+
+STARTUP_BUDGET_SECONDS = float(os.environ.get("STARTUP_BUDGET_SECONDS", 3.0))
+
+
+@dataclass
+class ImportTiming:
+    module: str
+    self_us: int
+    cumulative_us: int
+
+
+@dataclass
+class StartupReport:
+    module: str
+    wall_seconds: float
+    timings: list[ImportTiming]
+
+    @property
+    def import_seconds(self) -> float:
+        """Cumulative import time of the target module."""
+        for timing in self.timings:
+            if timing.module == self.module:
+                return timing.cumulative_us / 1_000_000
+        return 0.0
+
+    def top_packages(self, n: int = 20) -> list[ImportTiming]:
+        """Top-level packages (e.g. `chainlit`, `langgraph`) ordered by the cumulative import time."""
+        packages = [t for t in self.timings if "." not in t.module]
+        return sorted(packages, key=lambda t: t.cumulative_us, reverse=True)[:n]
+
+
+def _parse_importtime(stderr: str) -> list[ImportTiming]:
+    """Parse `import time: self [us] | cumulative | imported package` lines."""
+    timings = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        try:
+            self_us, cumulative_us, module = line[len("import time:"):].split("|")
+            timings.append(ImportTiming(
+                module=module.strip(),
+                self_us=int(self_us),
+                cumulative_us=int(cumulative_us),
+            ))
+        except ValueError:
+            continue
+    return timings
+
+
+def profile_startup(module: str = "app") -> StartupReport:
+    """Import the given module in a fresh interpreter and collect the import timings."""
+    started_at = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+    )
+    wall_seconds = time.perf_counter() - started_at
+    if completed.returncode != 0:
+        raise RuntimeError(
+            f"Failed to import {module}:\n{completed.stderr.strip().splitlines()[-1]}")
+    return StartupReport(
+        module=module,
+        wall_seconds=wall_seconds,
+        timings=_parse_importtime(completed.stderr),
+    )
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--module", default="app",
+                        help="module to import (default: app)")
+    parser.add_argument("--budget", type=float, default=STARTUP_BUDGET_SECONDS,
+                        help="cold start budget in seconds (default: STARTUP_BUDGET_SECONDS or 3.0)")
+    parser.add_argument("--top", type=int, default=20,
+                        help="number of packages to report (default: 20)")
+    args = parser.parse_args()
+
+    report = profile_startup(args.module)
+    print(f"{'cumulative(ms)':>15} {'self(ms)':>10}  package")
+    for timing in report.top_packages(args.top):
+        print(
+            f"{timing.cumulative_us / 1000:>15.1f} {timing.self_us / 1000:>10.1f}  {timing.module}")
+    print(
+        f"\nimport {report.module}: {report.import_seconds:.3f}s, "
+        f"interpreter wall time: {report.wall_seconds:.3f}s, budget: {args.budget:.3f}s"
+    )
+
+    if report.wall_seconds > args.budget:
+        print(
+            f"Cold start exceeds the budget by {report.wall_seconds - args.budget:.3f}s", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
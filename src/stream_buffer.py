@@ -0,0 +1,109 @@
+import os
+import asyncio
+from threading import Lock
+from typing import Awaitable, Callable, Optional
+
+# flush the buffered tokens at least this often, in seconds
+STREAM_FLUSH_INTERVAL = float(os.environ.get("STREAM_FLUSH_INTERVAL", 0.05))
+# flush as soon as the buffered tokens reach this many characters
+STREAM_FLUSH_CHARS = int(os.environ.get("STREAM_FLUSH_CHARS", 256))
+
+
+class StreamStats:
+    """Frames sent to the client per streamed answer."""
+
+    def __init__(self) -> None:
+        self.answers = 0
+        self.tokens = 0
+        self.frames = 0
+        self._lock = Lock()
+
+    def add(self, tokens: int, frames: int) -> None:
+        with self._lock:
+            self.answers += 1
+            self.tokens += tokens
+            self.frames += frames
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "answers": self.answers,
+                "tokens": self.tokens,
+                "frames": self.frames,
+                "frames_per_answer": round(self.frames / self.answers, 2) if self.answers else 0.0,
+                "tokens_per_frame": round(self.tokens / self.frames, 2) if self.frames else 0.0,
+            }
+
+
+stream_stats = StreamStats()
+
+
+class TokenStreamBuffer:
+    """
+    TokenStreamBuffer coalesces streamed tokens into fewer frames to the client.
+
+    The first token is sent right away to keep time-to-first-token low,
+    after that tokens are buffered and flushed every `flush_interval` seconds or once they reach `max_chars`.
+
+    async with TokenStreamBuffer(cl_msg.stream_token) as buffer:
+        async for text in stream:
+            await buffer.write(text)
+    """
+
+    def __init__(
+        self,
+        sink: Callable[[str], Awaitable[None]],
+        flush_interval: float = STREAM_FLUSH_INTERVAL,
+        max_chars: int = STREAM_FLUSH_CHARS,
+        stats: StreamStats = stream_stats,
+    ) -> None:
+        self.sink = sink
+        self.flush_interval = flush_interval
+        self.max_chars = max_chars
+        self.stats = stats
+        self.tokens = 0
+        self.frames = 0
+        self._buffer: list[str] = []
+        self._size = 0
+        self._timer: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+
+    async def write(self, token: str) -> None:
+        if not token:
+            return
+        self.tokens += 1
+        self._buffer.append(token)
+        self._size += len(token)
+        if self.frames == 0 or self._size >= self.max_chars:
+            await self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self.flush_interval)
+        self._timer = None
+        await self.flush()
+
+    async def flush(self) -> None:
+        async with self._lock:
+            if not self._buffer:
+                return
+            text = "".join(self._buffer)
+            self._buffer = []
+            self._size = 0
+            self.frames += 1
+            await self.sink(text)
+
+    async def close(self) -> None:
+        """Flush the remaining tokens and record the stats of the answer."""
+        if self._timer and self._timer is not asyncio.current_task():
+            self._timer.cancel()
+            self._timer = None
+        await self.flush()
+        self.stats.add(self.tokens, self.frames)
+
+    async def __aenter__(self) -> "TokenStreamBuffer":
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.close()
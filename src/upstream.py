@@ -0,0 +1,216 @@
+"""
+Every call to an upstream service (Bedrock, Tavily, Rerank) goes through this module,
+so recording and replaying a workload does not need to know about each node.
+
+- kind: upstream service, e.g. `bedrock`, `tavily`, `rerank`
+- name: caller of the service, e.g. `semantic_router`, `web_search`
+- key: optional request key to match the recorded response, e.g. search query
+
+Calls are rate limited per kind with a token bucket, configured by `UPSTREAM_RATE_LIMITS`,
+e.g. `bedrock=4,tavily=10` for at most 4 Bedrock and 10 Tavily requests per second. Replayed calls are not limited.
+"""
+
+import os
+import time
+import asyncio
+from threading import Lock
+from collections import Counter
+from contextlib import aclosing
+from typing import Any, AsyncIterator, Awaitable, Callable, Optional, TypeVar
+
+from .cancellation import RequestCancelled, cancel_stats, current_scope
+from .workload.recording import current_recording, current_replay, identity
+
+T = TypeVar("T")
+
+
+def _parse_rate_limits(value: str) -> dict[str, float]:
+    limits = {}
+    for item in filter(None, (i.strip() for i in value.split(","))):
+        kind, _, rate = item.partition("=")
+        limits[kind.strip()] = float(rate)
+    return limits
+
+
+# requests per second by kind, kinds which are not listed are not limited
+UPSTREAM_RATE_LIMITS = _parse_rate_limits(os.environ.get("UPSTREAM_RATE_LIMITS", ""))
+
+
+class TokenBucket:
+    """
+    Token bucket refilled at `rate` tokens per second, holding at most `burst` tokens.
+
+    A caller reserves a token and waits until it is due, so callers are served in order even when the bucket is empty.
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None) -> None:
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate)
+        self.tokens = self.burst
+        self.updated_at = time.monotonic()
+        self._lock = Lock()
+
+    def reserve(self) -> float:
+        """Take a token, returns the seconds to wait before it may be used."""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            self.tokens -= 1
+            return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+
+class RateLimitStats:
+    def __init__(self) -> None:
+        self._lock = Lock()
+        self.throttled = Counter()
+        self.wait_seconds = Counter()
+
+    def waited(self, kind: str, seconds: float) -> None:
+        with self._lock:
+            self.throttled[kind] += 1
+            self.wait_seconds[kind] += seconds
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "limits": dict(UPSTREAM_RATE_LIMITS),
+                "throttled": dict(self.throttled),
+                "wait_seconds": {k: round(v, 3) for k, v in self.wait_seconds.items()},
+            }
+
+
+rate_limit_stats = RateLimitStats()
+_buckets = {kind: TokenBucket(rate) for kind, rate in UPSTREAM_RATE_LIMITS.items() if rate > 0}
+
+
+def _reserve(kind: str) -> float:
+    bucket = _buckets.get(kind)
+    if not bucket:
+        return 0.0
+    wait = bucket.reserve()
+    if wait > 0:
+        rate_limit_stats.waited(kind, wait)
+    return wait
+
+
+def caches_enabled() -> bool:
+    """
+    Whether the caches in front of upstream calls may be used.
+
+    Not while recording or replaying a workload: a response served from a cache would be missing from the recording,
+    and a replay must serve every response from the recording, not from what an earlier conversation cached.
+    """
+    return current_recording.get() is None and current_replay.get() is None
+
+
+def _check_cancelled(kind: str) -> None:
+    """Do not start an upstream call for a cancelled request."""
+    scope = current_scope.get()
+    if scope and scope.cancelled:
+        cancel_stats.skipped(kind)
+        scope.check()
+
+
+def call(
+    kind: str,
+    name: str,
+    fn: Callable[[], T],
+    key: Optional[str] = None,
+    encode: Callable[[T], Any] = identity,
+    decode: Callable[[Any], T] = identity,
+) -> T:
+    """Call the upstream service synchronously, or serve the recorded response while replaying."""
+    _check_cancelled(kind)
+    replay = current_replay.get()
+    if replay:
+        entry = replay.take(kind, name, key)
+        time.sleep(replay.delay(entry))
+        return decode(entry["response"])
+
+    if wait := _reserve(kind):
+        time.sleep(wait)
+    started = time.perf_counter()
+    response = fn()
+    elapsed = time.perf_counter() - started
+
+    record = current_recording.get()
+    if record:
+        record.add_upstream(kind, name, key, encode(response), elapsed)
+    return response
+
+
+async def acall(
+    kind: str,
+    name: str,
+    fn: Callable[[], Awaitable[T]],
+    key: Optional[str] = None,
+    encode: Callable[[T], Any] = identity,
+    decode: Callable[[Any], T] = identity,
+) -> T:
+    """Async version of `call`."""
+    _check_cancelled(kind)
+    replay = current_replay.get()
+    if replay:
+        entry = replay.take(kind, name, key)
+        await asyncio.sleep(replay.delay(entry))
+        return decode(entry["response"])
+
+    if wait := _reserve(kind):
+        await asyncio.sleep(wait)
+    started = time.perf_counter()
+    response = await fn()
+    elapsed = time.perf_counter() - started
+
+    record = current_recording.get()
+    if record:
+        record.add_upstream(kind, name, key, encode(response), elapsed)
+    return response
+
+
+async def astream_text(
+    kind: str,
+    name: str,
+    fn: Callable[[], AsyncIterator[str]],
+    key: Optional[str] = None,
+) -> AsyncIterator[str]:
+    """
+    Stream text chunks from the upstream service, or the recorded chunks while replaying.
+
+    The response is recorded as a list of `[offset, text]` pairs, offset from the start of the stream.
+    """
+    _check_cancelled(kind)
+    replay = current_replay.get()
+    if replay:
+        entry = replay.take(kind, name, key)
+        last_offset = 0.0
+        for offset, text in entry["response"]:
+            await asyncio.sleep(max(0.0, offset - last_offset) / replay.speedup
+                                if replay.speedup > 0 else 0.0)
+            last_offset = offset
+            yield text
+        return
+
+    if wait := _reserve(kind):
+        await asyncio.sleep(wait)
+    record = current_recording.get()
+    scope = current_scope.get()
+    started = time.perf_counter()
+    chunks = []
+    try:
+        # close the upstream stream right away when the request is cancelled
+        async with aclosing(fn()) as stream:
+            async for text in stream:
+                if scope:
+                    scope.check()
+                if record:
+                    chunks.append([round(time.perf_counter() - started, 4), text])
+                yield text
+    except (asyncio.CancelledError, GeneratorExit, RequestCancelled):
+        # the rest of the stream is not generated
+        cancel_stats.stream_aborted()
+        raise
+
+    if record:
+        record.add_upstream(kind, name, key, chunks,
+                            time.perf_counter() - started)
@@ -0,0 +1,94 @@
+"""
+Per-request latency deadline.
+
+The deadline is carried in `ResearchState` and every stage consults it to degrade step by step as the budget runs out:
+
+| fraction of budget left | degradation                                                     |
+|-------------------------|-----------------------------------------------------------------|
+| < 0.7                   | `cap_tasks`: plan at most 2 tasks (1 task below 0.4)            |
+| any                     | `partial_search`: cut the search timeout to the remaining time  |
+| < 0.3                   | `cached_search`: serve cached queries, send one uncached query  |
+| < 0.25                  | `skip_tasks`: drop the remaining tasks once there are sources,  |
+|                         | or solve only the next one without sources (none once spent)    |
+| < 0.2                   | `skip_rerank`: order sources by Tavily score, skip page fetch   |
+| < 0.15                  | `shrink_context`: fewer and shorter sources for the summarizer  |
+| any                     | `overflow`: not admitted, quick responder only                  |
+"""
+
+import os
+import time
+from threading import Lock
+from collections import Counter
+from contextvars import ContextVar
+from typing import Optional
+
+from ..logger import get_logger
+
+logger = get_logger("deadline")
+
+# end-to-end latency budget of a request in seconds, 0 to disable
+REQUEST_DEADLINE_SECONDS = float(os.environ.get("REQUEST_DEADLINE_SECONDS", 0))
+
+
+class DegradationStats:
+    def __init__(self) -> None:
+        self._lock = Lock()
+        self.requests = 0
+        self.degraded_requests = 0
+        self.degradations = Counter()
+
+    def finished(self, deadline: "Deadline") -> None:
+        with self._lock:
+            self.requests += 1
+            if deadline.degradations:
+                self.degraded_requests += 1
+            self.degradations.update(set(deadline.degradations))
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "degraded_requests": self.degraded_requests,
+                "degradations": dict(self.degradations),
+            }
+
+
+degradation_stats = DegradationStats()
+
+
+class Deadline:
+    def __init__(self, budget: float) -> None:
+        self.budget = budget
+        self.expires_at = time.monotonic() + budget
+        self.degradations: list[str] = []
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def fraction_left(self) -> float:
+        return self.remaining() / self.budget if self.budget > 0 else 1.0
+
+    def below(self, fraction: float) -> bool:
+        """Check if less than the given fraction of the budget is left."""
+        return self.fraction_left() < fraction
+
+    def degrade(self, name: str, detail: str = "") -> None:
+        """Record a degradation which fired for this request."""
+        self.degradations.append(name)
+        logger.info("Degradation %s with %.2fs left %s",
+                    name, self.remaining(), detail)
+
+    def finish(self) -> None:
+        degradation_stats.finished(self)
+
+    def __repr__(self) -> str:
+        return f"Deadline(remaining={self.remaining():.2f}s, degradations={self.degradations})"
+
+
+def new_deadline(budget: float = REQUEST_DEADLINE_SECONDS) -> Optional[Deadline]:
+    return Deadline(budget) if budget > 0 else None
+
+
+# tools are invoked without the state, `task_solver` sets the deadline of the request for them
+current_deadline: ContextVar[Optional[Deadline]] = ContextVar(
+    "current_deadline", default=None)
@@ -2,6 +2,8 @@ from langchain_aws import ChatBedrockConverse
 from langgraph.graph import StateGraph, END
 from langchain_core.tools import StructuredTool
 
+from ..llm_tiering import NodeModels
+from ..profiler import profiled
 from .state import ResearchState
 from .node.semantic_router import SemanticRouter
 from .node.structured_planner import StructuredPlanner
@@ -14,18 +16,22 @@ class ResearchFlow:
 
     def __init__(
         self,
-        model: ChatBedrockConverse,
+        model: ChatBedrockConverse | NodeModels,
     ) -> None:
+        """`model` is used by every node, unless models by node are given."""
+        models = model if isinstance(model, NodeModels) else NodeModels(model)
         tools: list[StructuredTool] = [
             web_search_tool,
         ]
 
         state_graph = StateGraph(ResearchState)
 
-        state_graph.add_node("semantic_router", SemanticRouter(model))
+        state_graph.add_node("semantic_router",
+                             profiled("semantic_router", SemanticRouter(models["semantic_router"])))
         state_graph.add_node("structured_planner",
-                             StructuredPlanner(model, tools))
-        state_graph.add_node("task_solver", TaskSolver(model, tools))
+                             profiled("structured_planner", StructuredPlanner(models["structured_planner"], tools)))
+        state_graph.add_node("task_solver",
+                             profiled("task_solver", TaskSolver(models["task_solver"], tools)))
 
         state_graph.set_entry_point("semantic_router")
         state_graph.add_conditional_edges(
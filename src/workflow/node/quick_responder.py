@@ -1,23 +1,19 @@
-from typing import cast
+from typing import cast, AsyncIterator, TYPE_CHECKING
 from datetime import datetime, timezone
 
-from langchain_core.messages import AIMessage
-from pydantic import BaseModel, Field
-from langchain_aws import ChatBedrockConverse
 from langchain.prompts import ChatPromptTemplate
 from langchain_core.prompt_values import PromptValue
+from langchain_core.language_models.chat_models import BaseChatModel
 
 from ..state import ResearchState
+from ... import upstream
 from ...logger import get_logger
+from ...stream_buffer import TokenStreamBuffer
 
-logger = get_logger("quick_responder")
-
+if TYPE_CHECKING:
+    import chainlit as cl
 
-class ChatResponse(BaseModel):
-    """ChatResponse represents the conversational response generated by the AI Chatbot."""
-
-    content: str = Field(
-        description="The content of the response, plain text or markdown.")
+logger = get_logger("quick_responder")
 
 
 SYSTEM_PROMPT = """
@@ -56,8 +52,8 @@ Please generate a comprehensive response based on the user input and previous co
 
 
 class QuickResponder:
-    def __init__(self, model: ChatBedrockConverse) -> None:
-        self.model = model.with_structured_output(ChatResponse)
+    def __init__(self, model: BaseChatModel) -> None:
+        self.model = model.with_config(tags=["final_node"])
         self.system_prompt = SYSTEM_PROMPT
         self.instruction = INSTRUCTION
 
@@ -76,10 +72,21 @@ class QuickResponder:
             }
         )
 
-    def __call__(self, state: ResearchState) -> ResearchState:
-        result = cast(ChatResponse, self.model.invoke(
-            self._build_messages(state)))
-        return {
-            **state,
-            "messages": [AIMessage(content=result.content)],
-        }
+    async def _astream_text(self, messages: PromptValue) -> AsyncIterator[str]:
+        async for chunk in self.model.astream(messages):
+            for content in chunk.content:
+                content = cast(dict, content)
+                if content.get("type", "unknown") == "text":
+                    yield content["text"]
+                else:
+                    logger.debug("end of text content: %s", content)
+
+    async def __call__(self, cl_msg: "cl.Message", state: ResearchState) -> None:
+        messages = self._build_messages(state)
+        async with TokenStreamBuffer(cl_msg.stream_token) as buffer:
+            async for text in upstream.astream_text(
+                "bedrock", "quick_responder",
+                lambda: self._astream_text(messages),
+            ):
+                await buffer.write(text)
+        logger.info("Streamed %d tokens in %d frames", buffer.tokens, buffer.frames)
@@ -6,6 +6,9 @@ from langchain.prompts import ChatPromptTemplate
 from langchain_core.prompt_values import PromptValue
 
 from ..state import ResearchState
+from ... import upstream
+from ...llm_cache import cached, cached_call
+from ...workload.recording import dump_model
 
 
 class Category(BaseModel):
@@ -80,6 +83,8 @@ class SemanticRouter:
 
     def __init__(self, model: ChatBedrockConverse) -> None:
         self.model = model.with_structured_output(Category)
+        self.cache = cached(
+            "semantic_router", model, "Category", encode=dump_model, decode=Category.model_validate)
         self.system_prompt = SYSTEM_PROMPT
         self.instruction = INSTRUCTION
         self.categories = self._build_category_tags(
@@ -123,10 +128,15 @@ class SemanticRouter:
             }
         )
 
-    def __call__(self, state: ResearchState) -> ResearchState:
-        result = cast(Category, self.model.invoke(self._build_messages(state)))
+    def __call__(self, state: ResearchState) -> dict:
+        messages = self._build_messages(state)
+        result = cast(Category, cached_call(self.cache, messages, lambda: upstream.call(
+            "bedrock", "semantic_router",
+            lambda: self.model.invoke(messages),
+            encode=dump_model,
+            decode=Category.model_validate,
+        )))
         return {
-            **state,
             "user_input": result.revised_user_input or result.user_input,
             "category": result.name,
         }
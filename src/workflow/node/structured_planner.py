@@ -1,5 +1,4 @@
-from typing import cast
-from copy import deepcopy
+from typing import cast, Optional
 from datetime import datetime, timezone
 
 from langchain_aws import ChatBedrockConverse
@@ -8,6 +7,10 @@ from langchain_core.prompt_values import PromptValue
 from langchain_core.tools import StructuredTool
 
 from ..state import ResearchState, Plan
+from ..deadline import Deadline
+from ... import upstream
+from ...llm_cache import cached, cached_call
+from ...workload.recording import dump_model
 
 SYSTEM_PROMPT = """
 You are an strategic expert AI assistant generating a plan consisting of tasks for a given user input. \
@@ -66,10 +69,21 @@ Please generate a plan based on the user input and the available tools.
 class StructuredPlanner:
     def __init__(self, model: ChatBedrockConverse, tools: list[StructuredTool]) -> None:
         self.model = model.with_structured_output(Plan)
+        self.cache = cached(
+            "structured_planner", model, "Plan", encode=dump_model, decode=Plan.model_validate)
         self.system_prompt = SYSTEM_PROMPT
         self.instruction = INSTRUCTION
         self.tools = tools
 
+    def _cap_tasks(self, plan: Plan, deadline: Optional[Deadline]) -> None:
+        """Plan fewer tasks as the deadline approaches."""
+        if not deadline or not deadline.below(0.7):
+            return
+        cap = 1 if deadline.below(0.4) else 2
+        if len(plan.tasks) > cap:
+            deadline.degrade("cap_tasks", f"{len(plan.tasks)} -> {cap}")
+            plan.tasks = plan.tasks[:cap]
+
     # generate tool description for each tool at tools
     def _generate_tool_desc(self) -> str:
         tool_descs = []
@@ -97,10 +111,16 @@ class StructuredPlanner:
             }
         )
 
-    def __call__(self, state: ResearchState) -> ResearchState:
-        result = cast(Plan, self.model.invoke(self._build_messages(state)))
+    def __call__(self, state: ResearchState) -> dict:
+        messages = self._build_messages(state)
+        result = cast(Plan, cached_call(self.cache, messages, lambda: upstream.call(
+            "bedrock", "structured_planner",
+            lambda: self.model.invoke(messages),
+            encode=dump_model,
+            decode=Plan.model_validate,
+        )))
+        self._cap_tasks(result, state.get("deadline"))
         return {
-            **state,
             "plan": result,
-            "remaining_tasks": deepcopy(result.tasks),
+            "remaining_tasks": result.tasks,
         }
@@ -1,15 +1,26 @@
 import json
-from typing import cast
+import contextvars
+from collections import Counter
+from threading import BoundedSemaphore
+from typing import cast, Optional
 from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
 
 from langchain_aws import ChatBedrockConverse
 from langchain.prompts import ChatPromptTemplate
-from langchain_core.messages import AIMessage
+from langchain_core.messages import AIMessage, ToolMessage, message_to_dict, messages_from_dict
 from langchain_core.prompt_values import PromptValue
 from langchain_core.tools import StructuredTool
 
 from ..state import ResearchState, Task
+from ... import upstream
+from ...cancellation import RequestCancelled, check_cancelled
+from ...llm_cache import cached, cached_call
+from ...profiler import profiler
 from ...logger import get_logger
+from ..deadline import current_deadline
+from ..tool.registry import registry
+from ..tool.search_budget import current_task_type
 
 logger = get_logger("task_solver")
 
@@ -60,6 +71,10 @@ Please select the appropriate tool from the list of available tools and take act
 class TaskSolver:
     def __init__(self, model: ChatBedrockConverse, tools: list[StructuredTool]) -> None:
         self.model = model.bind_tools(tools)
+        self.cache = cached(
+            "task_solver", model, ",".join(tool.name for tool in tools),
+            encode=message_to_dict, decode=lambda d: messages_from_dict([d])[0],
+        )
         self.system_prompt = SYSTEM_PROMPT
         self.instruction = INSTRUCTION
         self.tools = tools
@@ -90,27 +105,113 @@ class TaskSolver:
             }
         )
 
-    def __call__(self, state: ResearchState) -> ResearchState:
+    def _invoke_tool(self, tool_call: dict, semaphore: Optional[BoundedSemaphore] = None) -> ToolMessage | Exception:
+        """Invoke the tool, a failure is returned instead of raised so it does not affect the other calls of the step."""
+        selected_tool = self.tool_dict[tool_call["name"].lower()]
+        try:
+            check_cancelled()
+            if semaphore is None:
+                return selected_tool.invoke(tool_call)
+            with semaphore:
+                check_cancelled()
+                return selected_tool.invoke(tool_call)
+        except RequestCancelled:
+            raise
+        except Exception as e:
+            logger.exception("Tool %s failed", tool_call["name"])
+            return e
+
+    def _invoke_tools(self, tool_calls: list[dict]) -> list[ToolMessage | Exception]:
+        """
+        Invoke the tool calls of a step, results are in the order of the calls.
+
+        Calls of parallel-safe tools run concurrently on worker threads, at most `max_concurrency` per tool,
+        while the other calls run one after another on the current thread.
+        """
+        specs = [registry.spec(self.tool_dict[c["name"].lower()]) for c in tool_calls]
+        parallel = [i for i, spec in enumerate(specs) if spec.parallel_safe]
+        if len(tool_calls) < 2 or not parallel:
+            return [self._invoke_tool(c) for c in tool_calls]
+
+        results: list[ToolMessage | Exception | None] = [None] * len(tool_calls)
+        limits = {specs[i].tool.name: specs[i].max_concurrency for i in parallel}
+        counts = Counter(specs[i].tool.name for i in parallel)
+        semaphores = {name: BoundedSemaphore(limit) for name, limit in limits.items()}
+        workers = sum(min(counts[name], limit) for name, limit in limits.items())
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # worker threads do not inherit context variables, e.g. the request scope and deadline
+            futures = {
+                i: executor.submit(contextvars.copy_context().run, profiler.attached, self._invoke_tool,
+                                   tool_calls[i], semaphores[specs[i].tool.name])
+                for i in parallel
+            }
+            for i, tool_call in enumerate(tool_calls):
+                if i not in futures:
+                    results[i] = self._invoke_tool(tool_call)
+            for i, future in futures.items():
+                results[i] = future.result()
+        return cast(list[ToolMessage | Exception], results)
+
+    def __call__(self, state: ResearchState) -> dict:
         """If remaining tasks exists, take proper action to complete the task."""
-        task = state["remaining_tasks"].pop(0)
-        result = cast(AIMessage, self.model.invoke(self._build_messages(task)))
+        deadline = state.get("deadline")
+        # tasks popped once this one is done, 1 unless the deadline drops the tasks after it
+        pop = 1
+        if deadline and deadline.below(0.25):
+            if state.get("sources") or not deadline.remaining():
+                deadline.degrade("skip_tasks", f"{len(state['remaining_tasks'])} tasks")
+                return {
+                    "remaining_tasks": len(state["remaining_tasks"]),
+                    "tool_execution": None,
+                }
+            if len(state["remaining_tasks"]) > 1:
+                # no sources yet, solve this task only to have something to answer with
+                deadline.degrade("skip_tasks", f"{len(state['remaining_tasks']) - 1} tasks after this one")
+                pop = len(state["remaining_tasks"])
+
+        task = state["remaining_tasks"][0]
+        messages = self._build_messages(task)
+        result = cast(AIMessage, cached_call(self.cache, messages, lambda: upstream.call(
+            "bedrock", "task_solver",
+            lambda: self.model.invoke(messages),
+            key=task.title,
+            encode=message_to_dict,
+            decode=lambda d: messages_from_dict([d])[0],
+        )))
 
         tool_executions = []
         sources = []
         task_results = {}
-        for i, tool_call in enumerate(result.tool_calls):
+        # let the search budget controller adapt to the category of the router, one of a fixed set
+        task_type_token = current_task_type.set(state.get("category") or "default")
+        deadline_token = current_deadline.set(deadline)
+        tool_calls = []
+        for tool_call in result.tool_calls:
+            if tool_call["name"].lower() not in self.tool_dict:
+                logger.error(f"Tool {tool_call['name'].lower()} not found in available tools.")
+                continue
+            tool_calls.append(tool_call)
+        try:
+            msgs = self._invoke_tools(tool_calls)
+        finally:
+            current_task_type.reset(task_type_token)
+            current_deadline.reset(deadline_token)
+
+        for i, (tool_call, msg) in enumerate(zip(tool_calls, msgs)):
             tool_name = tool_call["name"].lower()
-            tool_args = tool_call["args"]
-            if tool_name not in self.tool_dict:
-                logger.error(f"Tool {tool_name} not found in available tools.")
+            if isinstance(msg, Exception):
+                tool_executions.append({
+                    "id": i+1,
+                    "name": tool_name,
+                    "args": tool_call["args"],
+                    "result": f"Error: {msg!r}",
+                })
                 continue
-            selected_tool = self.tool_dict[tool_name]
-            msg = selected_tool.invoke(tool_call)
             task_results[task.title] = msg.content
             tool_executions.append({
                 "id": i+1,
                 "name": tool_name,
-                "args": tool_args,
+                "args": tool_call["args"],
                 "result": msg.content,
             })
 
@@ -122,9 +223,10 @@ class TaskSolver:
                         f"Error in deserializing web search result: {msg.content}")
             else:
                 logger.error(f"Tool {tool_name} not supported.")
+        # only the delta, the reducers of `ResearchState` pop the task and append the sources
         return {
-            **state,
+            "remaining_tasks": pop,
             "tool_execution": tool_executions[-1] if tool_executions else None,
-            "sources": state.get("sources", []) + sources,
+            "sources": sources,
             "task_results": task_results,
         }
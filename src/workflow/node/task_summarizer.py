@@ -1,13 +1,17 @@
-from typing import cast
+from typing import cast, AsyncIterator, TYPE_CHECKING
 from datetime import datetime, timezone
 
-import chainlit as cl
 from langchain.prompts import ChatPromptTemplate
 from langchain_core.prompt_values import PromptValue
 from langchain_core.language_models.chat_models import BaseChatModel
 
 from ..state import ResearchState
+from ... import upstream
 from ...logger import get_logger
+from ...stream_buffer import TokenStreamBuffer
+
+if TYPE_CHECKING:
+    import chainlit as cl
 
 logger = get_logger("task_summarizer")
 
@@ -87,6 +91,11 @@ Please generate a comprehensive response based on the above information.
 """.strip()
 
 
+# context of the summarizer when the deadline of the request is close
+SHRUNK_SOURCES = 3
+SHRUNK_CONTENT_CHARS = 1000
+
+
 class TaskSummarizer:
     def __init__(self, model: BaseChatModel) -> None:
         self.model = model.with_config(tags=["final_node"])
@@ -120,11 +129,36 @@ class TaskSummarizer:
             }
         )
 
-    async def __call__(self, cl_msg: cl.Message, state: ResearchState) -> None:
-        async for chunk in self.model.astream(self._build_messages(state)):
+    async def _astream_text(self, messages: PromptValue) -> AsyncIterator[str]:
+        async for chunk in self.model.astream(messages):
             for content in chunk.content:
                 content = cast(dict, content)
                 if content.get("type", "unknown") == "text":
-                    await cl_msg.stream_token(content["text"])
+                    yield content["text"]
                 else:
-                    logger.debug(f"end of text content: {content}")
+                    logger.debug("end of text content: %s", content)
+
+    def _shrink_context(self, state: ResearchState) -> ResearchState:
+        """Summarize fewer and shorter sources as the deadline approaches."""
+        deadline = state.get("deadline")
+        if not deadline or not deadline.below(0.15) or len(state["sources"]) <= SHRUNK_SOURCES:
+            return state
+        deadline.degrade("shrink_context",
+                         f"{len(state['sources'])} -> {SHRUNK_SOURCES} sources")
+        return {
+            **state,
+            "sources": [
+                {**source, "content": source["content"][:SHRUNK_CONTENT_CHARS]}
+                for source in state["sources"][:SHRUNK_SOURCES]
+            ],
+        }
+
+    async def __call__(self, cl_msg: "cl.Message", state: ResearchState) -> None:
+        messages = self._build_messages(self._shrink_context(state))
+        async with TokenStreamBuffer(cl_msg.stream_token) as buffer:
+            async for text in upstream.astream_text(
+                "bedrock", "task_summarizer",
+                lambda: self._astream_text(messages),
+            ):
+                await buffer.write(text)
+        logger.info("Streamed %d tokens in %d frames", buffer.tokens, buffer.frames)
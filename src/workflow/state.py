@@ -1,10 +1,13 @@
-from typing import Annotated
+import operator
+from typing import Annotated, Optional, Union
 
 from pydantic import BaseModel, Field
 from langchain_core.messages.tool import ToolCall
 from langgraph.graph.message import add_messages
 from typing_extensions import TypedDict
 
+from .deadline import Deadline
+
 
 class Task(BaseModel):
     """Task describes the individual tasks to be executed in order to complete the plan."""
@@ -34,19 +37,38 @@ class Plan(BaseModel):
         return "\n".join([f"{i+1}. {task.title}: {task.description}" for i, task in enumerate(self.tasks)])
 
 
+def update_task_queue(left: list[Task], right: Union[list[Task], int]) -> list[Task]:
+    """Reducer of the task queue, a list of tasks enqueues them and a number pops that many tasks from the head."""
+    if isinstance(right, int):
+        return left[right:]
+    return left + right
+
+
+def merge_dicts(left: dict, right: dict) -> dict:
+    return {**left, **right}
+
+
 class ResearchState(TypedDict):
     """
+    Nodes return only the keys they update, annotated keys are merged by their reducer instead of being overwritten.
+
     messages: list of chat messages, for conversation history
     user_input: the user input
+    category: the category of the user input. `semantic_router` will fills it.
     plan: the plan to complete the user input. `structured_planner` will fills it.
-    remaining_tasks: remaning task queue. `structured_planner` will fills it.
+    remaining_tasks: remaning task queue. `structured_planner` enqueues tasks, `task_solver` pops them.
     tool_execution: last exectuted tool call. `task_solver` will fills it.
-    sources: searched url links, `task_solver.web_search` will fills it.
+    sources: searched url links, append-only. `task_solver.web_search` will fills it.
+    task_results: tool results by task title, merged. `task_solver` will fills it.
+    deadline: latency deadline of the request, every stage consults it to degrade gracefully. None for no deadline.
     """
 
     messages: Annotated[list, add_messages]
     user_input: str
+    category: str
     plan: Plan
-    remaining_tasks: list[Task]
-    tool_execution: ToolCall
-    sources: list
+    remaining_tasks: Annotated[list[Task], update_task_queue]
+    tool_execution: Optional[ToolCall]
+    sources: Annotated[list, operator.add]
+    task_results: Annotated[dict[str, str], merge_dicts]
+    deadline: Optional[Deadline]
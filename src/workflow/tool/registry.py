@@ -0,0 +1,40 @@
+"""
+Registry of the tools with their execution policy.
+
+A tool declares whether its calls may run concurrently with other calls of the same step, and how many of its calls may run at once.
+Tools which are not registered run one call at a time, after each other.
+"""
+
+from dataclasses import dataclass
+from typing import Optional
+
+from langchain_core.tools import BaseTool
+
+
+@dataclass(frozen=True)
+class ToolSpec:
+    tool: BaseTool
+    # calls of the tool do not depend on each other nor share unsafe state, they may run concurrently
+    parallel_safe: bool = False
+    # calls of the tool running at once within a step
+    max_concurrency: int = 1
+
+
+class ToolRegistry:
+    def __init__(self) -> None:
+        self._specs: dict[str, ToolSpec] = {}
+
+    def register(self, tool: BaseTool, parallel_safe: bool = False, max_concurrency: int = 1) -> BaseTool:
+        self._specs[tool.name.lower()] = ToolSpec(
+            tool, parallel_safe=parallel_safe, max_concurrency=max(1, max_concurrency))
+        return tool
+
+    def get(self, name: str) -> Optional[ToolSpec]:
+        return self._specs.get(name.lower())
+
+    def spec(self, tool: BaseTool) -> ToolSpec:
+        """Policy of the tool, a tool which is not registered is not parallel safe."""
+        return self.get(tool.name) or ToolSpec(tool)
+
+
+registry = ToolRegistry()
@@ -0,0 +1,149 @@
+import os
+from threading import Lock
+from dataclasses import dataclass
+from contextvars import ContextVar
+from urllib.parse import urlparse
+
+TAVILY_K = int(os.environ.get("TAVILY_K", 3))
+WEB_SEARCH_ADAPTIVE = os.environ.get(
+    "WEB_SEARCH_ADAPTIVE", "true").lower() == "true"
+WEB_SEARCH_TIMEOUT = float(os.environ.get("WEB_SEARCH_TIMEOUT", 10))
+WEB_SEARCH_SCORE_THRESHOLD = float(
+    os.environ.get("WEB_SEARCH_SCORE_THRESHOLD", 0.45))
+# stop waiting for the remaining queries once this many high-scoring results from different sites arrived
+WEB_SEARCH_TARGET_RESULTS = int(os.environ.get("WEB_SEARCH_TARGET_RESULTS", 5))
+
+# the task type of the current search, `task_solver` sets it with the category of the router
+current_task_type: ContextVar[str] = ContextVar(
+    "current_task_type", default="default")
+
+
+@dataclass
+class SearchPlan:
+    """How to run the web search for the given queries."""
+
+    queries: list[str]
+    max_results: int
+    target_results: int
+
+
+@dataclass
+class _TaskTypeStats:
+    """Exponential moving averages of the score distributions observed for a task type."""
+
+    searches: int = 0
+    good_ratio: float = 0.0
+    top_score: float = 0.0
+
+
+class SearchBudgetController:
+    """
+    SearchBudgetController decides how many queries to send and how many results to request per query.
+
+    Task types whose searches mostly return high-scoring results (easy questions) get fewer queries and results,
+    task types with low scores (hard questions) get every query and more results per query.
+    The search stops waiting once enough high-scoring results from different sites have arrived.
+    """
+
+    def __init__(
+        self,
+        max_results: int = TAVILY_K,
+        target_results: int = WEB_SEARCH_TARGET_RESULTS,
+        score_threshold: float = WEB_SEARCH_SCORE_THRESHOLD,
+        adaptive: bool = WEB_SEARCH_ADAPTIVE,
+        warmup: int = 3,
+        alpha: float = 0.2,
+    ) -> None:
+        self.max_results = max_results
+        self.target_results = target_results
+        self.score_threshold = score_threshold
+        self.adaptive = adaptive
+        self.warmup = warmup
+        self.alpha = alpha
+        self._stats: dict[str, _TaskTypeStats] = {}
+        self._lock = Lock()
+        self.counters = {
+            "searches": 0,
+            "queries_sent": 0,
+            "queries_skipped": 0,
+            "early_stops": 0,
+        }
+
+    def plan(self, queries: list[str], task_type: str = "default") -> SearchPlan:
+        queries = list(dict.fromkeys(q.strip() for q in queries if q.strip()))
+        plan = SearchPlan(
+            queries=queries,
+            max_results=self.max_results,
+            target_results=self.target_results,
+        )
+
+        with self._lock:
+            self._adapt(plan, task_type)
+            self.counters["searches"] += 1
+            self.counters["queries_sent"] += len(plan.queries)
+            self.counters["queries_skipped"] += len(queries) - len(plan.queries)
+        return plan
+
+    def _adapt(self, plan: SearchPlan, task_type: str) -> None:
+        stats = self._stats.get(task_type)
+        if self.adaptive and stats and stats.searches >= self.warmup:
+            if stats.good_ratio >= 0.7 and stats.top_score >= 0.8:
+                # easy: a couple of queries with fewer results are enough
+                plan.queries = plan.queries[:2]
+                plan.max_results = max(2, self.max_results - 1)
+            elif stats.good_ratio < 0.3:
+                # hard: keep every query and dig deeper, but do not stop early
+                plan.max_results = min(self.max_results + 2, 10)
+                plan.target_results = len(plan.queries) * plan.max_results
+
+    def max_results_for(self, task_type: str = "default") -> int:
+        """Results per query the next search of the task type would request, without counting a search."""
+        plan = SearchPlan(queries=[], max_results=self.max_results, target_results=self.target_results)
+        with self._lock:
+            self._adapt(plan, task_type)
+        return plan.max_results
+
+    def enough(self, plan: SearchPlan, results: list[dict]) -> bool:
+        """Check if the high-scoring results are enough and diverse enough to stop waiting."""
+        if len(results) < plan.target_results:
+            return False
+        sites = {urlparse(r["url"]).netloc for r in results}
+        return len(sites) >= min(plan.target_results, 2)
+
+    def observe(self, task_type: str, results: list[dict], early_stop: bool = False) -> None:
+        """Update the score distribution of the task type with every returned result."""
+        if not results:
+            good_ratio, top_score = 0.0, 0.0
+        else:
+            scores = [r["score"] for r in results]
+            good_ratio = sum(
+                s > self.score_threshold for s in scores) / len(scores)
+            top_score = max(scores)
+
+        with self._lock:
+            stats = self._stats.setdefault(task_type, _TaskTypeStats())
+            if stats.searches == 0:
+                stats.good_ratio, stats.top_score = good_ratio, top_score
+            else:
+                stats.good_ratio += self.alpha * (good_ratio - stats.good_ratio)
+                stats.top_score += self.alpha * (top_score - stats.top_score)
+            stats.searches += 1
+            if early_stop:
+                self.counters["early_stops"] += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                **self.counters,
+                "task_types": {
+                    name: {
+                        "searches": s.searches,
+                        "good_ratio": round(s.good_ratio, 3),
+                        "top_score": round(s.top_score, 3),
+                    }
+                    for name, s in self._stats.items()
+                },
+            }
+
+
+controller = SearchBudgetController()
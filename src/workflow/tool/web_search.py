@@ -1,21 +1,77 @@
 import os
+import time
 import traceback
-from concurrent.futures import ThreadPoolExecutor
+import contextvars
+from functools import cache
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import cast, TYPE_CHECKING
 
 from pydantic import BaseModel, Field
 from langchain_core.tools import StructuredTool
-from tavily import TavilyClient
 
+from ... import upstream
+from ...cancellation import RequestCancelled, cancel_stats, check_cancelled
 from ...logger import get_logger
+from ...cache import PREFETCH, TTLCache
+from ...profiler import profiler
+from ..deadline import Deadline, current_deadline
+from .registry import registry
+from .search_budget import controller, current_task_type, TAVILY_K, WEB_SEARCH_TIMEOUT
 
 logger = get_logger("web_search_tool")
 
+SEARCH_CACHE_TTL = float(os.environ.get("SEARCH_CACHE_TTL", 600))
 
-TAVILY_API_KEY = os.environ.get("TAVILY_API_KEY", None)
-assert TAVILY_API_KEY, "TAVILY_API_KEY environment variable not set"
-TAVILY_K = int(os.environ.get("TAVILY_K", 3))
+# search results by (query, max_results)
+search_cache: TTLCache[tuple[str, int], dict] = TTLCache(
+    maxsize=4096, ttl=SEARCH_CACHE_TTL)
 
-client = TavilyClient(api_key=TAVILY_API_KEY)
+# seconds between checks for the cancellation of the request while waiting for the results
+CANCEL_POLL_INTERVAL = 0.1
+
+# web_search calls of a task running at once, each call runs its queries concurrently as well
+WEB_SEARCH_MAX_PARALLEL_CALLS = int(os.environ.get("WEB_SEARCH_MAX_PARALLEL_CALLS", 3))
+
+
+if TYPE_CHECKING:
+    from tavily import TavilyClient
+    from ...local_index.index import LocalIndex
+
+# "tavily" searches the web only, "local" searches the local index only,
+# "hybrid" merges local index results with web results
+SEARCH_BACKEND = os.environ.get("SEARCH_BACKEND", "tavily").lower()
+LOCAL_INDEX_DIR = os.environ.get("LOCAL_INDEX_DIR", "data/index")
+LOCAL_INDEX_EMBEDDING_MODEL = os.environ.get("LOCAL_INDEX_EMBEDDING_MODEL", "")
+# in hybrid mode, skip the web search for a query if the local index alone returns enough high-scoring results
+LOCAL_INDEX_PREFER = os.environ.get(
+    "LOCAL_INDEX_PREFER", "false").lower() == "true"
+
+
+@cache
+def _get_client() -> "TavilyClient":
+    """Create the Tavily client on the first search, so importing this module needs no credentials."""
+    from tavily import TavilyClient
+
+    api_key = os.environ.get("TAVILY_API_KEY", None)
+    assert api_key, "TAVILY_API_KEY environment variable not set"
+    return TavilyClient(api_key=api_key)
+
+
+@cache
+def _get_local_index() -> "LocalIndex":
+    from ...local_index.index import LocalIndex
+
+    embed = None
+    if LOCAL_INDEX_EMBEDDING_MODEL:
+        from ...local_index.build import get_embedder
+
+        embed = get_embedder(
+            LOCAL_INDEX_EMBEDDING_MODEL,
+            os.environ.get("AWS_PROFILE_NAME", None),
+            os.environ.get("AWS_REGION", None),
+        )
+    logger.info("Local index at %s", LOCAL_INDEX_DIR)
+    return LocalIndex(LOCAL_INDEX_DIR, embed=embed)
 
 
 class WebSearchInput(BaseModel):
@@ -38,10 +94,76 @@ class WebSearchInput(BaseModel):
     )
 
 
-def _tavily_search(query: str) -> dict:
+def _tavily_search(query: str, max_results: int) -> dict:
     """Perform a search using the Tavily API."""
-    logger.info(f"Searching for: {query}...")
-    return client.search(query, max_results=TAVILY_K)
+    logger.info("Searching for: %s...", query)
+    return upstream.call(
+        "tavily", "web_search",
+        lambda: _get_client().search(query, max_results=max_results),
+        key=query,
+    )
+
+
+def _local_search(query: str, max_results: int) -> dict:
+    """Perform a search on the local index, same result shape as Tavily."""
+    logger.info("Searching local index for: %s...", query)
+    return {"results": _get_local_index().search(query, max_results=max_results)}
+
+
+def _search(query: str, max_results: int) -> dict:
+    """Search the query on the configured backend."""
+    if SEARCH_BACKEND == "local":
+        return _local_search(query, max_results)
+    if SEARCH_BACKEND != "hybrid":
+        return _tavily_search(query, max_results)
+
+    local = _local_search(query, max_results)
+    good = [r for r in local["results"] if r["score"] > controller.score_threshold]
+    if LOCAL_INDEX_PREFER and len(good) >= max_results:
+        return local
+    web = _tavily_search(query, max_results)
+    return {"results": local["results"] + web["results"]}
+
+
+def _is_cached(query: str, max_results: int) -> bool:
+    return upstream.caches_enabled() and (query, max_results) in search_cache
+
+
+def _cached_search(query: str, max_results: int) -> dict:
+    """Search the query, reusing the results of the same query searched recently unless a workload is recorded or replayed."""
+    if not upstream.caches_enabled():
+        return _search(query, max_results)
+    key = (query, max_results)
+    result = search_cache.get(key)
+    if result is None:
+        result = _search(query, max_results)
+        search_cache.set(key, result)
+    return result
+
+
+def prefetch_search(query: str, max_results: int = TAVILY_K) -> None:
+    """Warm the search cache for a query the user is likely to search next, unless it is already cached."""
+    key = (query, max_results)
+    if key in search_cache:
+        return
+    result = _search(query, max_results)
+    search_cache.set(key, result, origin=PREFETCH)
+
+
+def _apply_deadline(queries: list[str], max_results: int) -> tuple[list[str], float]:
+    """Trim the queries and the timeout to the deadline of the request."""
+    deadline = current_deadline.get()
+    if not deadline:
+        return queries, WEB_SEARCH_TIMEOUT
+
+    if deadline.below(0.3):
+        cached = [q for q in queries if _is_cached(q, max_results)]
+        uncached = [q for q in queries if not _is_cached(q, max_results)]
+        if len(uncached) > 1:
+            deadline.degrade("cached_search",
+                             f"{len(cached)} cached, {len(uncached) - 1} dropped")
+            queries = cached + uncached[:1]
+    return queries, min(WEB_SEARCH_TIMEOUT, deadline.remaining())
 
 
 def web_search(queries: list[str]) -> list:
@@ -56,23 +178,70 @@ def web_search(queries: list[str]) -> list:
      - Generate 2-3 relevant search queries based on a given task to web searches.
      - Each query should capture the main intent of the task in different perspectives or contexts.
     """
-    TIMEOUT = 10
-    SCORE_THRESHOLD = 0.45
+    task_type = current_task_type.get()
+    plan = controller.plan(queries, task_type)
+    plan.queries, timeout = _apply_deadline(plan.queries, plan.max_results)
     results = []
+    observed = []
+    early_stop = False
+
+    def collect(result: dict) -> None:
+        observed.extend(result["results"])
+        results.extend([r for r in result["results"]
+                       if r["score"] > controller.score_threshold])
+
+    executor = ThreadPoolExecutor(max_workers=max(1, len(plan.queries)))
+    pending = set()
     try:
-        with ThreadPoolExecutor(max_workers=TAVILY_K) as executor:
-            future_results = executor.map(
-                _tavily_search, queries, timeout=TIMEOUT)
-            for result in future_results:
-                results.extend([r for r in result["results"]
-                               if r["score"] > SCORE_THRESHOLD])
-        logger.info(f"Web search results: {len(results)}")
+        check_cancelled()
+        # cached queries are served right away, so they are kept even when the deadline is already spent
+        uncached = []
+        for query in plan.queries:
+            cached = search_cache.get((query, plan.max_results)) if upstream.caches_enabled() else None
+            if cached is None:
+                uncached.append(query)
+            else:
+                collect(cached)
+        # worker threads do not inherit context variables, e.g. the workload recording
+        pending = {
+            executor.submit(contextvars.copy_context().run, profiler.attached,
+                            _cached_search, query, plan.max_results)
+            for query in uncached
+        }
+        expires_at = time.monotonic() + timeout
+        while pending and not early_stop:
+            # wake up regularly to abort the search once the request is cancelled
+            check_cancelled()
+            remaining = expires_at - time.monotonic()
+            # collect the searches which are done before giving up
+            done, pending = wait(pending, timeout=max(0.0, min(remaining, CANCEL_POLL_INTERVAL)),
+                                 return_when=FIRST_COMPLETED)
+            if not done and remaining <= 0:
+                raise TimeoutError()
+            for future in done:
+                collect(future.result())
+            if pending and controller.enough(plan, results):
+                early_stop = True
+                logger.info("Web search stopped early with %d results", len(results))
+        logger.info("Web search results: %d", len(results))
+    except RequestCancelled:
+        cancel_stats.search_cancelled(len(pending))
+        logger.info("Web search cancelled with %d pending queries", len(pending))
+        raise
     except TimeoutError:
-        traceback.print_exc()
-        logger.error("Web search failed with timeout.")
+        if timeout < WEB_SEARCH_TIMEOUT:
+            cast(Deadline, current_deadline.get()).degrade(
+                "partial_search", f"{len(pending)} queries dropped")
+        else:
+            traceback.print_exc()
+            logger.error("Web search failed with timeout.")
     except Exception:
         traceback.print_exc()
         logger.error("Web search failed with exception")
+    finally:
+        # do not wait for the slow or unnecessary queries
+        executor.shutdown(wait=False, cancel_futures=True)
+    controller.observe(task_type, observed, early_stop=early_stop)
     return results
 
 
@@ -83,3 +252,4 @@ tool = StructuredTool.from_function(
     args_schema=WebSearchInput,
     return_direct=True,
 )
+registry.register(tool, parallel_safe=True, max_concurrency=WEB_SEARCH_MAX_PARALLEL_CALLS)
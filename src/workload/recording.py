@@ -0,0 +1,143 @@
+"""
+Workload recordings: each conversation turn is captured as one JSON line.
+
+{
+    "id": "...", "session_id": "...", "started_at": 1730000000.0, "duration": 12.3,
+    "user_input": "...", "history": [...],
+    "events": [{"t": 1.2, "node": "structured_planner"}, ...],
+    "upstream": [{"kind": "tavily", "name": "web_search", "key": "...", "t": 2.1, "elapsed": 0.8, "response": {...}}, ...]
+}
+
+`t` is the offset from the start of the turn and `elapsed` is the latency of the upstream call, both in seconds.
+"""
+
+import json
+import time
+import uuid
+from pathlib import Path
+from threading import Lock
+from contextvars import ContextVar
+from typing import Any, Optional
+
+from langchain_core.messages import BaseMessage, messages_to_dict
+
+
+class ReplayMiss(LookupError):
+    """The recording has no response for the requested upstream call."""
+
+
+class ConversationRecord:
+    """Collects the node events and upstream responses of a single conversation turn."""
+
+    def __init__(self, session_id: str, user_input: str, history: list[BaseMessage]) -> None:
+        self.id = uuid.uuid4().hex
+        self.session_id = session_id
+        self.user_input = user_input
+        self.history = messages_to_dict(history)
+        self.started_at = time.time()
+        self._started = time.perf_counter()
+        self.events: list[dict] = []
+        self.upstream: list[dict] = []
+        self.duration: Optional[float] = None
+        self._lock = Lock()
+
+    def offset(self) -> float:
+        return round(time.perf_counter() - self._started, 4)
+
+    def add_event(self, node: str) -> None:
+        with self._lock:
+            self.events.append({"t": self.offset(), "node": node})
+
+    def add_upstream(self, kind: str, name: str, key: Optional[str], response: Any, elapsed: float) -> None:
+        with self._lock:
+            self.upstream.append({
+                "kind": kind,
+                "name": name,
+                "key": key,
+                "t": round(self.offset() - elapsed, 4),
+                "elapsed": round(elapsed, 4),
+                "response": response,
+            })
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "session_id": self.session_id,
+            "started_at": self.started_at,
+            "duration": self.duration,
+            "user_input": self.user_input,
+            "history": self.history,
+            "events": self.events,
+            "upstream": self.upstream,
+        }
+
+
+class WorkloadRecorder:
+    """Appends finished conversation records to a JSONL file."""
+
+    def __init__(self, path: str) -> None:
+        self.path = Path(path)
+        _ = self.path.parent.exists() or self.path.parent.mkdir(exist_ok=True, parents=True)
+        self._lock = Lock()
+
+    def start(self, session_id: str, user_input: str, history: list[BaseMessage]) -> ConversationRecord:
+        return ConversationRecord(session_id, user_input, history)
+
+    def finish(self, record: ConversationRecord) -> None:
+        record.duration = record.offset()
+        line = json.dumps(record.to_dict(), ensure_ascii=False,
+                          separators=(",", ":"), default=str)
+        with self._lock, self.path.open("a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+class ReplaySource:
+    """
+    Serves the recorded upstream responses of a conversation.
+
+    Responses are matched by (kind, name, key) in the recorded order,
+    and fall back to the next unused response of the same (kind, name) when the key differs.
+    The recorded latency is reproduced, divided by `speedup`.
+    """
+
+    def __init__(self, record: dict, speedup: float = 1.0) -> None:
+        self.record = record
+        self.speedup = speedup
+        self._entries = list(record["upstream"])
+        self._used = [False] * len(self._entries)
+        self._lock = Lock()
+        self.misses = 0
+
+    def take(self, kind: str, name: str, key: Optional[str]) -> dict:
+        with self._lock:
+            candidates = [
+                i for i, e in enumerate(self._entries)
+                if not self._used[i] and e["kind"] == kind and e["name"] == name
+            ]
+            exact = [i for i in candidates if self._entries[i]["key"] == key]
+            selected = exact or candidates
+            if not selected:
+                self.misses += 1
+                raise ReplayMiss(f"No recorded response for {kind}/{name}: {key}")
+            self._used[selected[0]] = True
+            return self._entries[selected[0]]
+
+    def delay(self, entry: dict) -> float:
+        return entry["elapsed"] / self.speedup if self.speedup > 0 else 0.0
+
+
+# set by `app.on_message` while recording and by the replayer while replaying
+current_recording: ContextVar[Optional[ConversationRecord]] = ContextVar(
+    "current_recording", default=None)
+current_replay: ContextVar[Optional[ReplaySource]] = ContextVar(
+    "current_replay", default=None)
+
+
+def dump_model(obj: Any) -> Any:
+    """Encode a pydantic model response as a JSON value."""
+    return obj.model_dump(mode="json")
+
+
+def identity(obj: Any) -> Any:
+    return obj
+
@@ -0,0 +1,142 @@
+"""
+Replay recorded conversations through `ResearchFlow` without network access.
+
+Upstream responses (Bedrock, Tavily, Rerank) are served from the recording with the recorded latency divided by the speedup,
+and conversations arrive with the recorded inter-arrival time divided by the speedup.
+
+    uv run -- python -m src.workload.replayer recordings.jsonl --speedup 10 --concurrency 8
+"""
+
+import sys
+import json
+import asyncio
+import argparse
+import statistics
+from time import perf_counter
+from typing import Any, Optional
+
+from langchain_core.messages import messages_from_dict
+
+from .recording import ReplaySource, current_replay
+from ..pipeline import ResearchPipeline
+
+
+class _ReplayModel:
+    """Stand-in for the chat model, every upstream call is served by `ReplaySource` instead."""
+
+    def with_structured_output(self, *args, **kwargs) -> "_ReplayModel":
+        return self
+
+    def bind_tools(self, *args, **kwargs) -> "_ReplayModel":
+        return self
+
+    def with_config(self, *args, **kwargs) -> "_ReplayModel":
+        return self
+
+    def invoke(self, *args, **kwargs) -> Any:
+        raise RuntimeError("The chat model should not be invoked while replaying.")
+
+    async def astream(self, *args, **kwargs) -> Any:
+        raise RuntimeError("The chat model should not be invoked while replaying.")
+
+
+def load_recordings(path: str) -> list[dict]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class Replayer:
+    def __init__(self, speedup: float = 1.0, concurrency: int = 4) -> None:
+        model: Any = _ReplayModel()
+        self.pipeline = ResearchPipeline(model)
+        self.speedup = speedup
+        self.semaphore = asyncio.Semaphore(concurrency)
+
+    async def _run(self, record: dict) -> str:
+        """Mirror of `app.on_message` without the UI."""
+        result = await self.pipeline.run(
+            record["user_input"],
+            messages_from_dict(record["history"]),
+        )
+        return result["answer"]
+
+    async def replay_one(self, record: dict, delay: float) -> dict:
+        await asyncio.sleep(delay)
+        async with self.semaphore:
+            source = ReplaySource(record, self.speedup)
+            token = current_replay.set(source)
+            started = perf_counter()
+            error: Optional[str] = None
+            try:
+                await self._run(record)
+            except Exception as e:
+                error = repr(e)
+            finally:
+                current_replay.reset(token)
+            return {
+                "id": record["id"],
+                "latency": perf_counter() - started,
+                "recorded_duration": record.get("duration"),
+                "misses": source.misses,
+                "error": error,
+            }
+
+    async def replay(self, records: list[dict], keep_arrival: bool = True) -> list[dict]:
+        first = min((r["started_at"] for r in records), default=0.0)
+        return await asyncio.gather(*[
+            self.replay_one(
+                record,
+                (record["started_at"] - first) / self.speedup
+                if keep_arrival and self.speedup > 0 else 0.0,
+            )
+            for record in records
+        ])
+
+
+def _percentile(values: list[float], q: float) -> float:
+    if len(values) < 2:
+        return values[0] if values else 0.0
+    return statistics.quantiles(values, n=100, method="inclusive")[int(q) - 1]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("recordings", help="JSONL file written with WORKLOAD_RECORD_PATH")
+    parser.add_argument("--speedup", type=float, default=1.0,
+                        help="divide recorded latencies and inter-arrival times by this factor, 0 for no delay")
+    parser.add_argument("--concurrency", type=int, default=4,
+                        help="maximum number of conversations replayed at once")
+    parser.add_argument("--repeat", type=int, default=1,
+                        help="replay the recordings this many times")
+    parser.add_argument("--closed-loop", action="store_true",
+                        help="ignore the recorded arrival times and start conversations as soon as possible")
+    parser.add_argument("--output", help="write the result of each conversation to this JSONL file")
+    args = parser.parse_args()
+
+    records = load_recordings(args.recordings) * args.repeat
+    replayer = Replayer(speedup=args.speedup, concurrency=args.concurrency)
+
+    started = perf_counter()
+    results = asyncio.run(replayer.replay(records, keep_arrival=not args.closed_loop))
+    elapsed = perf_counter() - started
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            for result in results:
+                f.write(json.dumps(result) + "\n")
+
+    latencies = [r["latency"] for r in results if not r["error"]]
+    errors = [r for r in results if r["error"]]
+    print(f"conversations: {len(results)}, errors: {len(errors)}, "
+          f"misses: {sum(r['misses'] for r in results)}")
+    print(f"elapsed: {elapsed:.2f}s, throughput: {len(results) / elapsed:.2f} conv/s")
+    if latencies:
+        print(f"latency p50: {_percentile(latencies, 50):.3f}s, "
+              f"p95: {_percentile(latencies, 95):.3f}s, max: {max(latencies):.3f}s")
+    for result in errors[:5]:
+        print(f"  {result['id']}: {result['error']}", file=sys.stderr)
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,120 @@
+"""
+Page fetch stage against a local HTTP server: per-host limits, the byte cap, the timeout and ETag revalidation.
+
+    uv run -- python -m unittest tests.test_page_fetcher
+"""
+
+import time
+import asyncio
+import threading
+import unittest
+from typing import Optional
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from src.page_fetcher import PageFetcher
+
+PARAGRAPH = "<p>Paragraph {} of the page, long enough to be kept as a passage by the extractor.</p>"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: "_Server"
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+    def _send_html(self, body: bytes, headers: Optional[dict[str, str]] = None) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        if self.path == "/etag":
+            self.server.etag_requests.append(self.headers.get("If-None-Match"))
+            if self.headers.get("If-None-Match") == '"v1"':
+                self.send_response(304)
+                self.end_headers()
+                return
+            self._send_html(PARAGRAPH.format(0).encode(), {"ETag": '"v1"'})
+        elif self.path == "/large":
+            self._send_html("".join(PARAGRAPH.format(i) for i in range(20000)).encode())
+        elif self.path == "/slow":
+            time.sleep(2)
+            self._send_html(PARAGRAPH.format(0).encode())
+        elif self.path.startswith("/busy/"):
+            with self.server.lock:
+                self.server.in_flight += 1
+                self.server.max_in_flight = max(self.server.max_in_flight, self.server.in_flight)
+            time.sleep(0.2)
+            with self.server.lock:
+                self.server.in_flight -= 1
+            self._send_html(PARAGRAPH.format(self.path).encode())
+        else:
+            self.send_error(404)
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self) -> None:
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.etag_requests: list[Optional[str]] = []
+
+
+class PageFetcherTest(unittest.IsolatedAsyncioTestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.server = _Server()
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_address[1]}"
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    async def asyncTearDown(self) -> None:
+        if hasattr(self, "fetcher"):
+            await self.fetcher.client.aclose()
+
+    async def test_per_host_limit(self) -> None:
+        self.fetcher = PageFetcher(per_host=2, timeout=5)
+        pages = await asyncio.gather(*[self.fetcher.fetch(f"{self.base_url}/busy/{i}") for i in range(6)])
+        self.assertTrue(all(pages))
+        self.assertEqual(self.server.max_in_flight, 2)
+
+    async def test_byte_cap(self) -> None:
+        self.fetcher = PageFetcher(max_bytes=16 * 1024, timeout=5)
+        passages = await self.fetcher.fetch(f"{self.base_url}/large")
+        self.assertTrue(passages)
+        # the download stops at the cap, give or take a chunk
+        self.assertLess(sum(len(p) for p in passages), 16 * 1024 + 64 * 1024)
+        self.assertLess(len(passages), 20000)
+
+    async def test_timeout(self) -> None:
+        self.fetcher = PageFetcher(timeout=0.3)
+        started = time.perf_counter()
+        self.assertEqual(await self.fetcher.fetch(f"{self.base_url}/slow"), [])
+        self.assertLess(time.perf_counter() - started, 1.5)
+
+    async def test_etag_revalidation(self) -> None:
+        self.fetcher = PageFetcher(cache_ttl=0.1, timeout=5)
+        url = f"{self.base_url}/etag"
+        first = await self.fetcher.fetch(url)
+        self.assertEqual(len(first), 1)
+        # served from the cache while fresh
+        self.assertEqual(await self.fetcher.fetch(url), first)
+        await asyncio.sleep(0.2)
+        # expired, revalidated with the ETag and answered 304
+        self.assertEqual(await self.fetcher.fetch(url), first)
+        self.assertEqual(self.server.etag_requests, [None, '"v1"'])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+"""
+Replaying a recorded conversation without AWS configuration or network access.
+
+    uv run -- python -m unittest tests.test_replayer
+"""
+
+import os
+import unittest
+from unittest import mock
+
+from langchain_core.messages import AIMessage, message_to_dict
+
+from src.workload.replayer import Replayer
+
+SOURCE = {
+    "title": "Patch notes",
+    "url": "https://example.com/patch-notes",
+    "content": "The new season starts on Monday with a ranked reset.",
+    "score": 0.9,
+}
+
+
+def _upstream(kind: str, name: str, key, response) -> dict:
+    return {"kind": kind, "name": name, "key": key, "t": 0.0, "elapsed": 0.01, "response": response}
+
+
+def _record() -> dict:
+    task = {
+        "title": "Search the season start",
+        "description": "Find when the new season starts.",
+        "tool_name": "web_search",
+        "tool_args": {},
+    }
+    tool_call = AIMessage(content="", tool_calls=[
+        {"name": "web_search", "args": {"queries": ["new season start"]}, "id": "call-1"}])
+    return {
+        "id": "replay-test",
+        "session_id": "session",
+        "started_at": 0.0,
+        "duration": 1.0,
+        "user_input": "When does the new season start?",
+        "history": [],
+        "events": [],
+        "upstream": [
+            _upstream("bedrock", "semantic_router", None, {
+                "name": "Game",
+                "reason": "A question about a game.",
+                "user_input": "When does the new season start?",
+                "revised_user_input": "When does the new season start?",
+            }),
+            _upstream("bedrock", "structured_planner", None, {
+                "revised_user_input": "When does the new season start?",
+                "category": "season",
+                "overview": "Search the start date.",
+                "tasks": [task],
+            }),
+            _upstream("bedrock", "task_solver", task["title"], message_to_dict(tool_call)),
+            _upstream("tavily", "web_search", "new season start", {"results": [SOURCE]}),
+            _upstream("rerank", "reranker", "When does the new season start?", [{"index": 0}]),
+            _upstream("bedrock", "task_summarizer", None, [[0.0, "It starts "], [0.01, "on Monday."]]),
+        ],
+    }
+
+
+class ReplayerTest(unittest.IsolatedAsyncioTestCase):
+    async def test_replay_without_aws(self) -> None:
+        # restored on exit
+        with mock.patch.dict(os.environ):
+            for key in [k for k in os.environ if k.startswith("AWS_")]:
+                del os.environ[key]
+            os.environ["AWS_CONFIG_FILE"] = os.environ["AWS_SHARED_CREDENTIALS_FILE"] = os.devnull
+            replayer = Replayer(speedup=0, concurrency=1)
+            [result] = await replayer.replay([_record()])
+
+        self.assertIsNone(result["error"])
+        self.assertEqual(result["misses"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()